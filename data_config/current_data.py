@@ -3,6 +3,7 @@ import numpy as np
 import os
 import pandas as pd
 import pickle
+import support
 from scipy import interpolate
 import xarray as xr
 
@@ -78,6 +79,10 @@ from os import path
 #
 
 
+# Storage codecs (dtype, scale, fill) of eastward and northward current velocities [kn], see support.quantize
+CODECS = ((np.int16, 1e-3, -32768),) * 2
+
+
 class CurrentDataRetriever:
     def __init__(self,
                  t0,
@@ -105,6 +110,13 @@ class CurrentDataRetriever:
         self.dsSave = self.dataDir / 'netcdf_IN'
 
     def get_data(self):
+        """Memory maps of quantized (time, lat, lon) arrays of eastward and northward current velocities
+        (see CODECS), stored next to the combined netCDF file"""
+        fps = [self.dataFP.with_name('{}_{}.npy'.format(self.dataFP.stem, var)) for var in ['u', 'v']]
+        return support.mmap_arrays(fps, lambda: [support.quantize(arr, codec)
+                                                 for arr, codec in zip(self.load_data(), CODECS)])
+
+    def load_data(self):
         # First check if combined netCDF file exists
         if os.path.exists(self.dataFP):
             print('Loading current data into memory:'.format(self.dataFP), end=' ')
@@ -282,7 +294,7 @@ if __name__ == '__main__':
         lons, lats = lons[lonSlice], lats[latSlice]
 
         for date in dates:
-            data = CurrentDataRetriever(date, nDays=6, DIR=_DIR).get_data()
+            data = CurrentDataRetriever(date, nDays=6, DIR=_DIR).load_data()  # Unquantized velocities [kn]
             u, v = data[0], data[1]
             dateIdx = len(u) // 2
             u, v = u[dateIdx, latSlice, lonSlice], v[dateIdx, latSlice, lonSlice]
@@ -6,7 +6,7 @@ import sys
 
 from copy import deepcopy
 from data_config.navigable_area import NavigableAreaGenerator
-from evaluation import geo_x_geos
+from evaluation import geo_x_geos, strtree_x_segments
 from geodesic import Geodesic
 from mpl_toolkits.mplot3d import Axes3D
 from math import atan2, degrees, sqrt, radians, cos, sin
@@ -135,7 +135,8 @@ class Hexagraph:
             self.extLand = NavigableAreaGenerator(p, DIR=DIR).get_shoreline_rtree(getExterior=True)
             self.extEca = NavigableAreaGenerator(p, DIR=DIR).get_eca_rtree(getExterior=True)
             self.extBath = NavigableAreaGenerator(p, DIR=DIR).get_bathymetry_rtree(getExterior=True)
-            self.distance = Geodesic().distance
+            self.geod = Geodesic()
+            self.distance = self.geod.distance
             self.recursionLevel = p['graphDens']
             self.varRecursionLevel = p['graphVarDens']
             self.graph = nx.Graph()
@@ -381,10 +382,10 @@ class Hexagraph:
                 n1, n2 = (n for n in self.canals[canal]['nodes'])
                 p1, p2 = (self.canals[canal]['nodes'][n]['deg'] for n in self.canals[canal]['nodes'])
                 self.graph.add_edge(n1, n2)
-                dist1 = {n: self.distance(p1, p) for n, p in nx.get_node_attributes(self.graph, 'deg').items()
-                         if n != n1}
-                dist2 = {n: self.distance(p2, p) for n, p in nx.get_node_attributes(self.graph, 'deg').items()
-                         if n != n2}
+                nodes, ps = zip(*nx.get_node_attributes(self.graph, 'deg').items())
+                dist1 = dict(zip(nodes, self.geod.distance_many([p1] * len(ps), ps).tolist()))
+                dist2 = dict(zip(nodes, self.geod.distance_many([p2] * len(ps), ps).tolist()))
+                del dist1[n1], dist2[n2]
 
                 # Add edges from canal nodes to three nearest neighbours
                 for nn in nsmallest(3, dist1, key=dist1.get):
@@ -394,12 +395,16 @@ class Hexagraph:
 
             # Set edge attributes
             print('Setting edge attributes... ', end='')
-            for n1, n2 in self.graph.edges():
-                p1, p2 = self.graph.nodes[n1]['deg'], self.graph.nodes[n2]['deg']
-                miles = self.distance(p1, p2)
-                self.graph[n1][n2]['dist'] = miles
-                self.graph[n1][n2]['eca'] = miles * 10 if geo_x_geos(self.ecaTree, p1, p2) else miles
-                self.graph[n1][n2]['bath'] = miles * 1e+4 if not geo_x_geos(self.bathTree, p1, p2) else miles
+            edges = list(self.graph.edges())
+            q1s = np.array([self.graph.nodes[n1]['deg'] for n1, _ in edges], dtype=float).reshape(-1, 2)
+            q2s = np.array([self.graph.nodes[n2]['deg'] for _, n2 in edges], dtype=float).reshape(-1, 2)
+            miles = self.geod.distance_many(q1s, q2s)
+            inEca = strtree_x_segments(self.ecaTree['strtree'], q1s, q2s)
+            inBath = strtree_x_segments(self.bathTree['strtree'], q1s, q2s)
+            for (n1, n2), edgeMiles, edgeInEca, edgeInBath in zip(edges, miles.tolist(), inEca, inBath):
+                self.graph[n1][n2]['dist'] = edgeMiles
+                self.graph[n1][n2]['eca'] = edgeMiles * 10 if edgeInEca else edgeMiles
+                self.graph[n1][n2]['bath'] = edgeMiles * 1e+4 if not edgeInBath else edgeMiles
             print('done')
 
             # Set canal edge weights to predefined weights
@@ -1,10 +1,14 @@
 import matplotlib.pyplot as plt
 import fiona
+import numpy as np
 import os
 import pickle
+import shapely
+import support
 
 from pathlib import Path
 from rtree.index import Index
+from shapely import STRtree
 from shapely.geometry import box, Polygon, MultiPolygon, GeometryCollection, shape, LineString, Point
 
 
@@ -14,6 +18,7 @@ class NavigableAreaGenerator:
         self.splitThreshold = parameters['splits']
         self.avoidAntarctic = parameters['avoidAntarctic']
         self.avoidArctic = parameters['avoidArctic']
+        self.rasterCell = parameters.get('rasterCell', 0.25)
         self.gshhgDir = DIR / 'data/GSHHS_shp'
         self.shorelinesFP = self.gshhgDir / '{0}/GSHHS_{0}_L1.shp'.format(self.resolution)
         self.antarcticFP = self.gshhgDir / '{0}/GSHHS_{0}_L6.shp'.format(self.resolution)
@@ -38,8 +43,23 @@ class NavigableAreaGenerator:
                     exterior.append(cutLines[0])
                 exteriors.extend(exterior)
             shorelines = exteriors
+            return get_rtree(shorelines, fp)
 
-        return get_rtree(shorelines, fp)
+        treeDict = get_rtree(shorelines, fp)
+        treeDict['raster'] = get_raster(shorelines, fp, self.rasterCell)
+        return treeDict
+
+    def get_edge_store(self, segLengthF, exactArcs=False):
+        """Persistent leg feasibility store of navigable area, for feasibility segments of *segLengthF* nm
+        and land crossings tested on sampled segments or exact great circle arcs"""
+        aC = 'excl' if self.avoidArctic else 'incl'
+        aAc = 'excl' if self.avoidAntarctic else 'incl'
+        method = '_arcs2' if exactArcs else ''  # Stores '_arcs' hold legs wrongly tested feasible
+        fp = self.DIR / 'data/navigation_area/edges_{}_split{}_{}Antarc_{}Arc_F{}{}.sqlite'.format(self.resolution,
+                                                                                                self.splitThreshold,
+                                                                                                aAc, aC, segLengthF,
+                                                                                                method)
+        return support.EdgeStore(fp)
 
     def get_bathymetry_rtree(self, getExterior=False):
         fp = self.DIR / 'data/navigation_area/bath_split{}'.format(self.splitThreshold)
@@ -66,8 +86,11 @@ class NavigableAreaGenerator:
                     exterior.append(cutLines[0])
                 exteriors.extend(exterior)
             bathPolys = exteriors
+            return get_rtree(bathPolys, fp)
 
-        return get_rtree(bathPolys, fp)
+        treeDict = get_rtree(bathPolys, fp)
+        treeDict['raster'] = get_raster(bathPolys, fp, self.rasterCell)
+        return treeDict
 
     def get_shorelines(self, fp, split):
         if split and os.path.exists(fp):
@@ -194,8 +217,12 @@ class NavigableAreaGenerator:
                     exterior.append(cutLines[0])
                 exteriors.extend(exterior)
             ecas = exteriors
+            return get_rtree(ecas, fp)
 
-        return get_rtree(ecas, fp)
+        # Union bounding box of ECAs for quick rejection
+        treeDict = get_rtree(ecas, fp)
+        treeDict['bounds'] = tuple(shapely.total_bounds(ecas))
+        return treeDict
 
 
 def get_rtree(geometries, fp):
@@ -208,7 +235,34 @@ def get_rtree(geometries, fp):
             idx.insert(i, geo.bounds)
         idx.close()
 
-    return {'rtree': Index(fp), 'geometries': geometries}
+    # Shapely STRtree over the same geometries for bulk (array) queries
+    return {'rtree': Index(fp), 'strtree': STRtree(geometries), 'geometries': geometries}
+
+
+def get_raster(geometries, fp, cellSize):
+    """Classify cells of a global grid of *cellSize* degrees as all-water (0), all-land (1) or mixed (2),
+    where 'land' is the area covered by *geometries*. Raster is saved next to geometries file *fp*.
+    Returns dictionary with raster, summed area table of non-water cells and cell size"""
+    rasterFP = Path(fp.as_posix() + '_raster{}.npy'.format(cellSize))
+    if os.path.exists(rasterFP):
+        raster = np.load(rasterFP)
+    else:
+        print('Rasterize {}'.format(rasterFP))
+        tree = STRtree(geometries)
+        lons = np.arange(-180, 180, cellSize)
+        raster = np.zeros([int(round(180 / cellSize)), len(lons)], dtype=np.int8)
+        for i, lat in enumerate(np.arange(-90, 90, cellSize)):
+            cells = shapely.box(lons, lat, lons + cellSize, lat + cellSize)
+            cellIdx, _ = tree.query(cells, predicate='intersects')
+            raster[i, cellIdx] = 2
+            cellIdx, _ = tree.query(cells, predicate='within')
+            raster[i, cellIdx] = 1
+        np.save(rasterFP, raster)
+
+    # Summed area table for counting non-water cells in a rectangle of cells
+    sat = np.zeros([raster.shape[0] + 1, raster.shape[1] + 1], dtype=np.int32)
+    sat[1:, 1:] = np.cumsum(np.cumsum(raster > 0, axis=0), axis=1)
+    return {'raster': raster, 'sat': sat, 'cellSize': cellSize}
 
 
 def cut(line, distance):
@@ -224,8 +278,6 @@ def cut(line, distance):
 
 
 if __name__ == '__main__':
-    import numpy as np
-
     from matplotlib.collections import PatchCollection
     from matplotlib import patches
     from mpl_toolkits.basemap import Basemap
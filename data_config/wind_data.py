@@ -2,6 +2,7 @@ import numpy as np
 import os
 import requests
 import subprocess
+import support
 import sys
 import xarray as xr
 
@@ -9,6 +10,10 @@ from datetime import datetime, timedelta
 from pathlib import Path
 
 
+# Storage codecs (dtype, scale, fill) of Beaufort number and true wind direction [deg], see support.quantize
+CODECS = ((np.uint8, 1., 255), (np.uint16, 0.01, 65535))
+
+
 class WindDataRetriever:
     def __init__(self, startDate, nDays=20, DIR=Path('D:/')):
         self.t0 = startDate
@@ -93,6 +98,13 @@ class WindDataRetriever:
         print('Merged and saved {} GRIB files into'.format(len(fps)), self.dsFP)
 
     def get_data(self, forecast):
+        """Memory maps of quantized (time, lat, lon) arrays of Beaufort number and true wind direction (see CODECS),
+        stored next to the netCDF file"""
+        fps = [self.dsFP.with_name('{}_{}.npy'.format(self.dsFP.stem, var)) for var in ['BN', 'windDir']]
+        return support.mmap_arrays(fps, lambda: [support.quantize(arr, codec)
+                                                 for arr, codec in zip(self.load_data(forecast), CODECS)])
+
+    def load_data(self, forecast):
         if not os.path.exists(self.dsFP):
             print('{} does not exist, downloading GRIB files.'.format(self.dsFP))
             self.download_grib_files(forecast)
@@ -173,6 +185,6 @@ if __name__ == '__main__':
 
     os.chdir('..')
     retriever = WindDataRetriever(nDays=1, startDate=datetime(2011, 1, 25))  # 27 20
-    _ds = retriever.get_data(forecast=False)
+    _ds = retriever.load_data(forecast=False)  # Unquantized (variable, time, lat, lon) array
     plot_wind(_ds)
     plt.show()
@@ -2,22 +2,16 @@ import datetime
 import numpy as np
 import os
 import pandas as pd
+import shapely
 import support
+import uuid
 import weather
 
-from functools import lru_cache, wraps
-from math import cos, sin, sqrt, radians, pow
+from math import sqrt, pow
 from pathlib import Path
 from shapely.geometry import LineString, Point
 
 
-def delta_penalty(func):
-    @wraps(func)
-    def wrapper(self, individual, *args, **kwargs):
-        return func(self, individual, *args, **kwargs) if self.feasible(individual) else self.delta
-    return wrapper
-
-
 class Evaluator:
     def __init__(self,
                  vessel,
@@ -29,7 +23,9 @@ class Evaluator:
                  criteria,
                  parameters,
                  DIR,
-                 startDate=None):
+                 startDate=None,
+                 caches=None,
+                 edgeStore=None):
         self.vessel = vessel            # Vessel class instance
         self.landRtree = landRtree      # R-tree spatial index dictionary for shorelines
         self.ecaRtree = ecaRtree        # R-tree spatial index dictionary for ECAs
@@ -38,6 +34,9 @@ class Evaluator:
         self.startDate = startDate      # Start date of voyage
         self.segLengthF = parameters['segLengthF']    # Max segment length (for feasibility)
         self.segLengthC = parameters['segLengthC']    # Max segment length (for currents)
+        self.exactArcs = parameters.get('exactArcs', False)  # Test land crossings on exact great circle arcs
+        self.timeBuckets = parameters.get('timeBuckets', False)  # Interpolate leg times between data time steps
+        self.bucketTolerance = parameters.get('bucketTolerance', 0.01)  # Max. relative error of interpolation
         self.geod = geod                # Geod class instance
         self.currentOp = None
         self.weatherOp = None
@@ -50,51 +49,131 @@ class Evaluator:
         self.penaltyValue = parameters['penaltyValue']
         self.delta = (1e+20,) * len(criteria)
         self.DIR = DIR
-
-    def set_classes(self, inclCurr, inclWeather, startDate, nDays):
+        self.legsVersion = uuid.uuid4().hex  # Version of leg records stored on evaluated individuals
+        self.stepHours = None           # Time step [h] of weather/current data
+        self.stepOffset = 0.            # Hours from first time step of weather/current data to start date
+        self.horizonHours = np.inf      # Hours from start date to end of weather/current data period
+        self.nBeyondHorizon = 0         # Number of leg segments computed departing beyond the data period
+        self.edgeStore = edgeStore      # Persistent leg feasibility store (EdgeStore class instance)
+        self.sogSectors = parameters.get('sogSectors')  # Heading sectors of speed over ground field, if any
+        self.sogOp = None               # Operator on whose data window the speed over ground field is defined
+        self.sogTile = 4                # Grid points per side of the lazily computed tiles of the field
+
+        # Cache methods in (planner's) cache manager
+        self.caches = support.CacheManager() if caches is None else caches
+        self.leg_feasibility = self.caches.memoize('e_feasible', self.leg_feasibility)
+        self.exact_leg_hours = self.caches.memoize('exact_leg_hours', self.exact_leg_hours)
+        self.exact_leg_row = self.caches.memoize('leg_rows', self.exact_leg_row)
+        self.sog_tile = self.caches.memoize('sog_field', self.sog_tile)
+
+    def set_classes(self, inclCurr, inclWeather, startDate, nDays, region=None):
+        """Set weather and current operators for voyage from *startDate* of *nDays* days.
+        Operators load only data within lon/lat *region* (see support.lon_lat_region), if given"""
         self.startDate = startDate
         self.inclWeather = inclWeather
         self.inclCurrent = inclCurr
+
+        # Get operators from process-wide registry, and release operators of previous voyage
+        prevOps = [op for op in (self.currentOp, self.weatherOp) if op is not None]
+        self.currentOp = self.weatherOp = None
         if inclCurr:
             assert isinstance(startDate, datetime.date), 'Set start date'
             self.startDate = startDate = datetime.datetime(2016, 1, 1)
-            self.currentOp = weather.CurrentOperator(startDate, nDays, DIR=self.DIR, KC=self.vessel.name == 'Tanaka')
+            self.currentOp = weather.registry.acquire(weather.CurrentOperator, startDate, nDays, self.DIR, region,
+                                                      KC=self.vessel.name == 'Tanaka')
         if inclWeather:
             assert isinstance(startDate, datetime.date), 'Set start date'
-            self.weatherOp = weather.WindOperator(startDate, nDays, DIR=self.DIR)
+            self.weatherOp = weather.registry.acquire(weather.WindOperator, startDate, nDays, self.DIR, region)
+        for op in prevOps:
+            weather.registry.release(op)
+
+        # Time steps of the weather and current data; current time steps also divide the weather time steps
+        op = self.currentOp if inclCurr else self.weatherOp if inclWeather else None
+        if op is None:
+            self.stepHours, self.stepOffset = None, 0.
+        else:
+            self.stepHours = op.hourPeriod
+            self.stepOffset = (self.startDate - op.t0).total_seconds() / 3600.
+        self.horizonHours = min([op.horizon - (self.startDate - op.t0).total_seconds() / 3600.
+                                 for op in (self.currentOp, self.weatherOp) if op is not None], default=np.inf)
+        self.nBeyondHorizon = 0
+
+        # Speed over ground field on the data window of the finest operator, if enabled and data is cropped to region
+        self.sogOp = op if self.sogSectors and getattr(op, 'window', None) is not None else None
+        self.caches.clear('sog_field')
+
+        # Cached leg travel times and leg records of previous evaluations are invalid for new environmental conditions
+        self.caches.clear('exact_leg_hours')
+        self.caches.clear('leg_rows')
+        self.legsVersion = uuid.uuid4().hex
+
+    def set_fidelity(self, fast):
+        """Evaluate legs with fast Andoyer-Lambert distances in the array methods of an ellipsoidal geodesic,
+        e.g. during optimization, or with the exact ellipsoidal distances. Leg feasibility is tested with the
+        exact scalar distances in both modes, hence the 'e_feasible' cache and edge store do not depend on it"""
+        fast = fast and self.geod.distCalc == 'ellipsoidal'
+        if fast != self.geod.fastMany:
+            self.geod.fastMany = fast
+
+            # Cached leg travel times and leg records of previous evaluations are of other fidelity
+            self.caches.clear('exact_leg_hours')
+            self.caches.clear('leg_rows')
+            self.legsVersion = uuid.uuid4().hex
 
-    @delta_penalty
     def evaluate(self, ind, revert=None, includePenalty=None):
         self.includePenalty = self.bathymetry if includePenalty is None else includePenalty
         if revert is None:
             revert = self.revertOutput
 
+        # Feasibility and shallow water segments of legs
+        legsSegs = self.shallow_segments(ind)
+        if legsSegs is None:
+            return self.delta
+
         hours = cost = dist = ecaDist = 0.
+        prevLegs, legs, fullEval = self.prev_legs(ind), {}, False
 
-        for wp1, wp2 in zip(ind[:-1], ind[1:]):
+        # Distances inside ECAs of new legs, clipped at once. Legs of which only the speed changed reuse them
+        ecaMiles = self.prev_eca_miles(prevLegs)
+        if self.ecaFactor != 1.0:
+            newLegs = [(wp1[0], wp2[0]) for wp1, wp2 in zip(ind[:-1], ind[1:])
+                       if ecaMiles.get((wp1[0], wp2[0])) is None]
+            if newLegs:
+                ecaMiles.update(zip(newLegs, self.eca_miles(*zip(*newLegs)).tolist()))
+
+        for wp1, wp2, nSegs in zip(ind[:-1], ind[1:], legsSegs):
             # Leg endpoints and boat speed
             p1, speedKnots = wp1
             p2 = wp2[0]
 
-            # Leg travel time and fuel cost
-            legHours, nauticalMiles = self.leg_hours(p1, p2, hours, speedKnots)
+            # Leg travel time and fuel cost, reusing unchanged legs of previous evaluation
+            key = (p1, p2, speedKnots)
+            prevLeg = prevLegs.get(key)
+            leg = None if fullEval else self.shift_leg(prevLeg, hours)
+            fullEval = fullEval or (leg is None and key in prevLegs)
+            if leg is None:
+                legHours, nauticalMiles, window = self.leg_hours(p1, p2, hours, speedKnots)
+                leg = (hours, legHours, nauticalMiles, ecaMiles.get((p1, p2)), window)
+            if self.ecaFactor != 1.0 and leg[3] is None:
+                leg = leg[:3] + (ecaMiles[(p1, p2)],) + leg[4:]
+            legs[key] = leg
+            _, legHours, nauticalMiles, legEcaMiles, _ = leg
             legCost = self.vessel.fuelCostPerDay[speedKnots] * legHours / 24.  # x1000 EUR or USD
 
-            # If leg intersects ECA increase fuel consumption by ecaFactor
-            if self.ecaFactor != 1.0 and geo_x_geos(self.ecaRtree, p1, p2):
-                legCost *= self.ecaFactor
-                ecaDist += nauticalMiles
+            # Increase fuel consumption by ecaFactor for part of leg inside ECAs
+            if self.ecaFactor != 1.0 and legEcaMiles:
+                legCost *= 1 + (self.ecaFactor - 1) * min(legEcaMiles / nauticalMiles, 1.)
+                ecaDist += legEcaMiles
 
             if self.includePenalty:
-                nSegs = self.e_feasible(p1, p2)
-                legCost += (nSegs * self.segLengthF / nauticalMiles) * legCost * self.penaltyValue
-                legHours += (nSegs * self.segLengthF / nauticalMiles) * legHours / 24. * self.penaltyValue
+                legHours, legCost = self.shallow_penalty(nSegs, nauticalMiles, legHours, legCost)
 
             # Increment objective values
             hours += legHours
             cost += legCost
             dist += nauticalMiles
 
+        ind.legs = (self.legsVersion, legs)
         days = hours / 24.
         if revert:
             return cost, days
@@ -102,6 +181,146 @@ class Evaluator:
         #     print('hours', hours, 'distance', dist, 'ecaDist', ecaDist)
         return days, cost
 
+    def evaluate_batch(self, inds, revert=None, includePenalty=None):
+        """Evaluate a population at once. The legs of all feasible individuals are flattened into arrays,
+        leg values are computed array-wise and reduced per individual. Returns list of fitness values equal to
+        [self.evaluate(ind) for ind in inds]"""
+        self.includePenalty = self.bathymetry if includePenalty is None else includePenalty
+        if revert is None:
+            revert = self.revertOutput
+
+        fits = [self.delta] * len(inds)
+        indsSegs = [self.shallow_segments(ind) for ind in inds]
+        feasIdx = [i for i, legsSegs in enumerate(indsSegs) if legsSegs is not None]
+        if not feasIdx:
+            return fits
+
+        # Flatten legs of feasible individuals
+        indIdx, p1s, p2s, speeds, nSegs = [], [], [], [], []
+        for i, k in enumerate(feasIdx):
+            for wp1, wp2 in zip(inds[k][:-1], inds[k][1:]):
+                indIdx.append(i)
+                p1s.append(wp1[0])
+                p2s.append(wp2[0])
+                speeds.append(wp1[1])
+            nSegs.extend(indsSegs[k])
+        indIdx, speeds, nSegs = np.asarray(indIdx), np.asarray(speeds, dtype=float), np.asarray(nSegs, dtype=float)
+        nLegs = len(speeds)
+
+        # Leg distances and travel times, reusing unchanged legs of previous evaluations
+        legs = [None] * nLegs
+        if self.inclCurrent or self.inclWeather:
+            # Leg start times depend on preceding legs, hence walk each individual sequentially
+            for j in range(nLegs):
+                if j == 0 or indIdx[j] != indIdx[j-1]:
+                    hours, prevLegs, fullEval = 0., self.prev_legs(inds[feasIdx[indIdx[j]]]), False
+                    prevEcaMiles = self.prev_eca_miles(prevLegs)
+                key = (p1s[j], p2s[j], speeds[j].item())
+                prevLeg = prevLegs.get(key)
+                legs[j] = None if fullEval else self.shift_leg(prevLeg, hours)
+                fullEval = fullEval or (legs[j] is None and key in prevLegs)
+                if legs[j] is None:
+                    legHours, nauticalMiles, window = self.leg_hours(p1s[j], p2s[j], hours, speeds[j].item())
+                    legs[j] = (hours, legHours, nauticalMiles, prevEcaMiles.get((p1s[j], p2s[j])), window)
+                _, legHours, nauticalMiles, _, _ = legs[j]
+                if self.includePenalty:
+                    legHours, _ = self.shallow_penalty(nSegs[j], nauticalMiles, legHours, 0.)
+                hours += legHours
+        else:
+            ecaMiles = [None] * nLegs  # Of previous evaluations, for legs of which only the speed changed
+            for j in range(nLegs):
+                if j == 0 or indIdx[j] != indIdx[j-1]:
+                    prevLegs = self.prev_legs(inds[feasIdx[indIdx[j]]])
+                    prevEcaMiles = self.prev_eca_miles(prevLegs)
+                legs[j] = self.shift_leg(prevLegs.get((p1s[j], p2s[j], speeds[j].item())), 0.)
+                ecaMiles[j] = prevEcaMiles.get((p1s[j], p2s[j]))
+            newIdx = [j for j in range(nLegs) if legs[j] is None]
+            if newIdx:
+                newMiles = self.geod.distance_many([p1s[j] for j in newIdx], [p2s[j] for j in newIdx])
+                for j, nauticalMiles in zip(newIdx, newMiles.tolist()):
+                    legs[j] = (0., nauticalMiles / speeds[j].item(), nauticalMiles, ecaMiles[j], (-np.inf, np.inf))
+
+        # Distances inside ECAs of new legs, clipped at once
+        if self.ecaFactor != 1.0:
+            newIdx = [j for j in range(nLegs) if legs[j][3] is None]
+            if newIdx:
+                newEcaMiles = self.eca_miles([p1s[j] for j in newIdx], [p2s[j] for j in newIdx])
+                for j, ecaMiles in zip(newIdx, newEcaMiles.tolist()):
+                    legs[j] = legs[j][:3] + (ecaMiles,) + legs[j][4:]
+
+        # Store leg records on individuals
+        for i, k in enumerate(feasIdx):
+            inds[k].legs = (self.legsVersion, {})
+        for j in range(nLegs):
+            inds[feasIdx[indIdx[j]]].legs[1][(p1s[j], p2s[j], speeds[j].item())] = legs[j]
+
+        legHours = np.array([leg[1] for leg in legs])
+        nauticalMiles = np.array([leg[2] for leg in legs])
+
+        # Fuel cost, increased by ecaFactor for part of legs inside ECAs
+        fuelCostPerDay = np.array([self.vessel.fuelCostPerDay[speed] for speed in speeds.tolist()])
+        legCost = fuelCostPerDay * legHours / 24.  # x1000 EUR or USD
+        if self.ecaFactor != 1.0:
+            ecaFraction = np.minimum(np.array([leg[3] for leg in legs]) / nauticalMiles, 1.)
+            legCost = np.where(ecaFraction > 0, legCost * (1 + (self.ecaFactor - 1) * ecaFraction), legCost)
+
+        if self.includePenalty:
+            legHours, legCost = self.shallow_penalty(nSegs, nauticalMiles, legHours, legCost)
+
+        # Reduce leg values per individual
+        days = np.bincount(indIdx, weights=legHours, minlength=len(feasIdx)) / 24.
+        cost = np.bincount(indIdx, weights=legCost, minlength=len(feasIdx))
+        for i, k in enumerate(feasIdx):
+            fits[k] = (cost[i], days[i]) if revert else (days[i], cost[i])
+        return fits
+
+    def shallow_penalty(self, nSegs, nauticalMiles, legHours, legCost):
+        """Travel time and fuel cost of legs (or arrays of legs) penalized for their *nSegs* shallow water segments.
+        Leg start times follow from the penalized travel times of the preceding legs"""
+        share = nSegs * self.segLengthF / nauticalMiles * self.penaltyValue
+        return legHours + share * legHours / 24., legCost + share * legCost
+
+    def prev_legs(self, ind):
+        """Leg records of previous evaluation of *ind*, if evaluated under the current conditions"""
+        version, legs = getattr(ind, 'legs', (None, {}))
+        return legs if version == self.legsVersion else {}
+
+    def arrival_hours(self, inds):
+        """Latest arrival time [h] after start date of legs of evaluated individuals *inds*"""
+        return max((leg[0] + leg[1] for ind in inds for leg in self.prev_legs(ind).values()), default=0.)
+
+    @staticmethod
+    def prev_eca_miles(prevLegs):
+        """Distances inside ECAs of the leg geometries (p1, p2) of leg records *prevLegs*, which are independent of
+        the leg speeds"""
+        return {key[:2]: leg[3] for key, leg in prevLegs.items() if leg[3] is not None}
+
+    @staticmethod
+    def shift_leg(leg, startHours):
+        """Shift leg record (startHours, legHours, nauticalMiles, ecaMiles, window) to a new start time.
+        Returns None if there is no record, or if the shift moves a segment of the leg to another
+        weather/current time step, i.e. if it is not in the record's shift window"""
+        if leg is None:
+            return None
+        shift = startHours - leg[0]
+        lo, hi = leg[4]
+        if shift != 0 and not lo <= shift < hi:
+            return None
+        return startHours, leg[1], leg[2], leg[3], (lo - shift, hi - shift)
+
+    def eca_miles(self, p1s, p2s):
+        """Array of nautical miles inside ECAs for sequences of leg endpoints"""
+        lons, lats, offsets = self.geod.points_many(p1s, p2s, self.segLengthF)
+
+        # Segments between consecutive points of the same leg, skipping segments crossing datum line
+        legIdx = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))[:-1]
+        keep = np.ones(len(lons) - 1, dtype=bool)
+        keep[offsets[1:-1] - 1] = False
+        keep &= np.abs(np.diff(lons)) <= self.segLengthF * 10. / 60.
+        ps = np.column_stack([lons, lats])
+        segMiles = clip_miles(self.ecaRtree, ps[:-1][keep], ps[1:][keep], self.geod.ref_sys)
+        return np.bincount(legIdx[keep], weights=segMiles, minlength=len(offsets) - 1)
+
     def evaluate2(self, ind):
         hours = cost = dist = ecaDist = speedDist = 0.
         ecaSpeed, nonEcaSpeed = [], []
@@ -111,21 +330,21 @@ class Evaluator:
             p2 = wp2[0]
 
             # Leg travel time and fuel cost
-            legHours, nauticalMiles = self.leg_hours(p1, p2, hours, speedKnots)
+            legHours, nauticalMiles, _ = self.leg_hours(p1, p2, hours, speedKnots)
             legCost = self.vessel.fuelCostPerDay[speedKnots] * legHours / 24.  # x1000 EUR or USD
 
-            # If leg intersects ECA increase fuel consumption by ecaFactor
-            if self.ecaFactor != 1.0 and geo_x_geos(self.ecaRtree, p1, p2):
-                legCost *= self.ecaFactor
-                ecaDist += nauticalMiles
+            # Increase fuel consumption by ecaFactor for part of leg inside ECAs
+            legEcaMiles = self.eca_miles([p1], [p2])[0] if self.ecaFactor != 1.0 else 0.
+            if legEcaMiles:
+                legCost *= 1 + (self.ecaFactor - 1) * min(legEcaMiles / nauticalMiles, 1.)
+                ecaDist += legEcaMiles
                 ecaSpeed.append(speedKnots)
             else:
                 nonEcaSpeed.append(speedKnots)
 
             if self.includePenalty:
                 nSegs = self.e_feasible(p1, p2)
-                legCost += (nSegs * self.segLengthF / nauticalMiles) * legCost * self.penaltyValue
-                legHours += (nSegs * self.segLengthF / nauticalMiles) * legHours / 24. * self.penaltyValue
+                legHours, legCost = self.shallow_penalty(nSegs, nauticalMiles, legHours, legCost)
 
             # Increment objective values
             hours += legHours
@@ -139,84 +358,245 @@ class Evaluator:
         return days, cost, dist, ecaDist, avgSpeed, ecaSpeed, nonEcaSpeed
 
     def feasible(self, ind):
-        for i in range(len(ind)-1):
-            p1, p2 = sorted((ind[i][0], ind[i+1][0]))
-            if self.e_feasible(p1, p2) == 'inf':
-                return False
-        return True
+        return self.shallow_segments(ind) is not None
+
+    def shallow_segments(self, ind):
+        """Number of shallow water segments of each leg of *ind*, or None if a leg crosses land"""
+        legsSegs = []
+        for wp1, wp2 in zip(ind[:-1], ind[1:]):
+            nSegs = self.e_feasible(wp1[0], wp2[0])
+            if nSegs == 'inf':
+                return None
+            legsSegs.append(nSegs)
+        return legsSegs
 
-    @lru_cache(maxsize=int(1e+6))
     def e_feasible(self, p1, p2):
+        """Returns 'inf' if leg crosses land, else its number of shallow water segments (0 without bathymetry).
+        Both directions of a leg share one canonical leg key"""
+        p1, p2 = sorted((tuple(p1), tuple(p2)))
+        return self.leg_feasibility(p1, p2)
+
+    def leg_feasibility(self, p1, p2):
+        if self.edgeStore is None:
+            return self.edge_feasibility(p1, p2)
+
+        # Look up leg in persistent store of previous runs
+        value = self.edgeStore.get(p1, p2, self.bathymetry)
+        if value is None:
+            value = self.edge_feasibility(p1, p2)
+            self.edgeStore.put(p1, p2, self.bathymetry, value)
+        return value
+
+    def edge_feasibility(self, p1, p2):
+        if self.exactArcs:
+            if arc_x_geos(self.landRtree, p1, p2):  # If great circle arc crosses land obstacle
+                return 'inf'
+            elif not self.bathymetry:
+                return 0
         dist = self.geod.distance(p1, p2)
-        lons, lats = self.geod.points(p1, p2, dist, self.segLengthF)
-        lineSegs = np.stack([lons, lats]).T
+        q1s, q2s = self.split_segments(self.geod.points(p1, p2, dist, self.segLengthF))
+
+        # Check feasibility of all segments at once, and penalize sailing through shallow water
+        if not self.exactArcs and any_x_segments(self.landRtree, q1s, q2s):  # If a segment crosses land
+            return 'inf'
+        if self.bathymetry:
+            return int(np.count_nonzero(~geos_x_segments(self.bathRtree, q1s, q2s)))
+        return 0
+
+    def split_segments(self, lonLats):
+        """Get start and end points of consecutive line segments between points *lonLats* (lons, lats rows),
+        skipping segments crossing datum line"""
+        lineSegs = lonLats.T
 
         # since we know the difference between any two points, we can use this to find wrap arounds
         dLonMax = self.segLengthF * 10. / 60.
+        keep = np.abs(np.diff(lonLats[0])) <= dLonMax
+        if keep.all():
+            return lineSegs[:-1], lineSegs[1:]
+        return lineSegs[:-1][keep], lineSegs[1:][keep]
 
-        # calculate distances and compare with max allowable distance
-        dLons = np.abs(np.diff(lons))
-        cuts = np.where(dLons > dLonMax)[0]
-
-        # if there are any cut points, cut them and begin again at the next point
-        for i, cut in enumerate(cuts):
-            # create new vertices with a nan in between and set those as the path's vertices
-            segs = np.concatenate([lineSegs[:cut+1, :],
-                                   [[np.nan, np.nan]],
-                                   lineSegs[cut+1:, :]]
-                                  )
-            lineSegs = segs
-
-        # Check feasibility of each segment, and penalize sailing through shallow water
-        nSegs = 0
-        for q1, q2 in zip(lineSegs[:-1, :], lineSegs[1:, :]):
-            if not np.isnan(np.sum([q1, q2])):  # Skip segments crossing datum line
-                if geo_x_geos(self.landRtree, q1, q2):  # If segment crosses land obstacle
-                    return 'inf'
-                if self.includePenalty and not geo_x_geos(self.bathRtree, q1, q2):
-                    nSegs += 1
-        return nSegs
-
-    @lru_cache(maxsize=int(1e+6))
     def leg_hours(self, p1, p2, startHours, speedKnots):
+        """Returns leg travel time, distance and window (lo, hi) of start time shifts for which
+        the travel time does not change. With 'timeBuckets', travel times are interpolated between the data
+        time steps, unless their relative spread exceeds 'bucketTolerance'. Interpolated legs are not shifted"""
+        if (self.inclCurrent or self.inclWeather) and self.timeBuckets:
+            # Linearly interpolate between the leg travel times when departing at the
+            # weather/current time steps enclosing startHours, which are cached per time step
+            t0 = ((startHours + self.stepOffset) // self.stepHours) * self.stepHours - self.stepOffset
+            if t0 != startHours:
+                hours0, nauticalMiles, _ = self.exact_leg_hours(p1, p2, t0, speedKnots)
+                hours1, _, _ = self.exact_leg_hours(p1, p2, t0 + self.stepHours, speedKnots)
+
+                # Shifting the departure by less than a time step moves each segment by at most one time step.
+                # Hence, the spread of the enclosing travel times bounds the interpolation error
+                if abs(hours1 - hours0) <= self.bucketTolerance * min(hours0, hours1):
+                    legHours = hours0 + (hours1 - hours0) * (startHours - t0) / self.stepHours
+                    return legHours, nauticalMiles, (0., 0.)
+        return self.exact_leg_hours(p1, p2, startHours, speedKnots)
+
+    def leg_cache_info(self):
+        """Hits, misses and hit rate of leg travel time cache, and of the leg speed row cache (see exact_leg_row),
+        which is looked up on misses of the former"""
+        infos = [self.caches.info(name) for name in ('exact_leg_hours', 'leg_rows')]
+        return tuple(info[key] for info in infos for key in ('hits', 'misses', 'hitRate'))
+
+    def exact_leg_hours(self, p1, p2, startHours, speedKnots):
+        if (self.inclCurrent or self.inclWeather) and self.row_due(p1, p2, startHours, speedKnots):
+            legHours, nauticalMiles, windows = self.exact_leg_row(p1, p2, startHours)
+            i = self.vessel.speedIdx[speedKnots]
+            return legHours[i], nauticalMiles, windows[i]
         nauticalMiles = self.geod.distance(p1, p2)
         if self.inclCurrent or self.inclWeather:
             # Split leg in equally spaces segments of 'segLengthC' nautical miles
             lons, lats = self.geod.points(p1, p2, nauticalMiles, self.segLengthC)
-            segPoints = list(zip(lons, lats))
-            legHours = 0.
-            for q1, q2 in zip(segPoints[:-1], segPoints[1:]):
-                legHours += self.calc_seg_hours(q1, q2, speedKnots, startHours + legHours)
+            legHours, segHours = self.calc_segs_hours(lons, lats, speedKnots, startHours)
+            window = self.step_window(segHours)
         else:
-            legHours = nauticalMiles / speedKnots
-        return legHours, nauticalMiles
-
-    def calc_seg_hours(self, p1, p2, speedKnots, currentHours):
-        try:
-            now = self.startDate + datetime.timedelta(hours=currentHours)
-        except TypeError:
-            raise TypeError("Date {} ; currHours {}".format(self.startDate, currentHours))
-        nauticalMiles, bearingDeg = self.geod.distance(p1, p2, bearing=True)
-
-        # Coordinates of middle point of leg
+            legHours, window = nauticalMiles / speedKnots, (-np.inf, np.inf)
+        return legHours, nauticalMiles, window
+
+    def row_due(self, p1, p2, startHours, speedKnots):
+        """True if the leg travel times at all vessel speeds are (to be) cached in a row, i.e. if the leg
+        geometry departing at *startHours* was evaluated at another vessel speed before, e.g. after a speed mutation.
+        Otherwise, the leg is evaluated at *speedKnots* only"""
+        if speedKnots not in self.vessel.speedIdx:
+            return False
+        return self.caches.contains('leg_rows', (p1, p2, startHours)) or any(
+            self.caches.contains('exact_leg_hours', (p1, p2, startHours, speed))
+            for speed in self.vessel.speeds if speed != speedKnots)
+
+    def exact_leg_row(self, p1, p2, startHours):
+        """Leg travel times, distance and windows (see exact_leg_hours) at all vessel speeds, computed at once
+        when the leg is evaluated at a second speed (see row_due). Further speed changes of the leg are then looked
+        up in the cached row, as the leg geometry and its weather/current sampling points do not depend on the speed"""
+        nauticalMiles = self.geod.distance(p1, p2)
+        lons, lats = self.geod.points(p1, p2, nauticalMiles, self.segLengthC)
+        legHours, segHours = self.calc_segs_hours(lons, lats, np.array(self.vessel.speeds, dtype=float), startHours)
+        return legHours.tolist(), nauticalMiles, [self.step_window(hours) for hours in segHours]
+
+    def step_window(self, hours):
+        """Window (lo, hi) of time shifts for which all *hours* stay in their weather/current time step"""
+        if len(hours) == 0:
+            return -np.inf, np.inf
+        stepHours = (hours + self.stepOffset) / self.stepHours
+        lo = np.max(np.floor(stepHours) - stepHours) * self.stepHours
+        hi = np.min(np.floor(stepHours) + 1 - stepHours) * self.stepHours
+        return lo, hi
+
+    def calc_segs_hours(self, lons, lats, speedKnots, startHours):
+        """Travel times of the consecutive segments between points (lons, lats), sailed at their speeds over ground
+        at the segment middle points (see segment_speeds).
+        Segment departure times depend on the travel times of the preceding segments. Hence, iterate
+        from still water travel times until the departure time steps are fixed: each iteration fixes
+        at least the next segment, so this takes at most one iteration per segment.
+        Returns leg hours and departure hours of segments, or, for an array of speeds *speedKnots*,
+        arrays of these per speed (see exact_leg_row)"""
+        lons1, lats1, lons2, lats2 = lons[:-1], lats[:-1], lons[1:], lats[1:]
+        nauticalMiles, bearingsDeg = self.geod.distance_many(np.column_stack([lons1, lats1]),
+                                                             np.column_stack([lons2, lats2]), bearing=True)
+
+        # Coordinates of middle points of segments
         # If segment crosses datum line (-180 degrees), choose p1 as middle point
-        lon, lat = p1 if abs(p1[0] - p2[0]) > 300 else ((p1[0] + p2[0]) / 2, (p1[1] + p2[1]) / 2)
+        crossDatum = np.abs(lons1 - lons2) > 300
+        midLons = np.where(crossDatum, lons1, (lons1 + lons2) / 2)
+        midLats = np.where(crossDatum, lats1, (lats1 + lats2) / 2)
+
+        # Rows of segment speeds per nominal speed
+        nominalSpeeds = np.atleast_1d(np.asarray(speedKnots, dtype=float))
+        actualSpeedKnots = np.repeat(nominalSpeeds[:, None], len(nauticalMiles), axis=1)
+        steps = np.full(actualSpeedKnots.shape, np.nan)
+        cumHours = np.cumsum(nauticalMiles / actualSpeedKnots, axis=1)
+        for _ in range(len(nauticalMiles) + 1):
+            segHours = startHours + np.concatenate((np.zeros((len(nominalSpeeds), 1)), cumHours[:, :-1]), axis=1)
+
+            # Only update speeds of segments of which the departure time step changed
+            prevSteps, steps = steps, np.floor((segHours + self.stepOffset) / self.stepHours)
+            rows, idx = np.nonzero(steps != prevSteps)
+            if len(idx) == 0:
+                break
+            hours = segHours[rows, idx] + self.stepOffset  # Hours from t0 of weather/current data
+            actualSpeedKnots[rows, idx] = self.segment_speeds(hours, midLons[idx], midLats[idx], bearingsDeg[idx],
+                                                              nominalSpeeds[rows])
+            cumHours = np.cumsum(nauticalMiles / actualSpeedKnots, axis=1)
+
+        # Segments beyond the data period sail in its last time step
+        self.nBeyondHorizon += int(np.count_nonzero(segHours >= self.horizonHours))
+
+        if np.ndim(speedKnots):
+            return cumHours[:, -1], segHours
+        return float(cumHours[0, -1]), segHours[0]
+
+    def segment_speeds(self, hours, lons, lats, bearingsDeg, speedKnots):
+        """Speeds over ground [kn] of segments departing *hours* after t0 of the weather/current data, with middle
+        points (*lons*, *lats*), headings *bearingsDeg* and nominal *speedKnots* (a speed or array of speeds).
+        Looked up in the speed over ground field where it covers the segments (see sog_tile)"""
+        op = self.sogOp
+        if op is not None and np.ndim(speedKnots):
+            # Look up speeds per nominal speed
+            speeds = np.empty(len(hours))
+            for nominal in np.unique(speedKnots).tolist():
+                sel = speedKnots == nominal
+                speeds[sel] = self.segment_speeds(hours[sel], lons[sel], lats[sel], bearingsDeg[sel], nominal)
+            return speeds
+        if op is None or speedKnots not in self.vessel.speedIdx:
+            return self.sample_speeds(hours, lons, lats, bearingsDeg, speedKnots)
+
+        # Nearest grid points in data window, heading sectors and time steps (data holds first step before t0)
+        lon0, lat0, resolution = op.grid
+        nWinLats, nWinLons = op.window[0].shape[1:]
+        lonIdx = (np.round((lons - lon0) / resolution).astype(int) - op.offsets[1]) % op.data[0].shape[2]
+        latIdx = np.round((lats - lat0) / resolution).astype(int) - op.offsets[0]
+        sectors = np.round(bearingsDeg * self.sogSectors / 360.).astype(int) % self.sogSectors
+        steps = np.maximum(np.floor(hours / self.stepHours), 0).astype(int)
+        inside = (lonIdx < nWinLons) & (latIdx >= 0) & (latIdx < nWinLats)
+
+        # Look up speeds per time step and tile of the field
+        speeds = np.empty(len(hours))
+        if inside.any():
+            dims = (steps.max() + 1, -(-nWinLats // self.sogTile), -(-nWinLons // self.sogTile))
+            tiles = np.full(len(hours), -1)
+            tiles[inside] = np.ravel_multi_index((steps[inside], latIdx[inside] // self.sogTile,
+                                                  lonIdx[inside] // self.sogTile), dims)
+            for tile in np.unique(tiles[inside]):
+                sel = tiles == tile
+                step, tileLat, tileLon = np.unravel_index(tile, dims)
+                speeds[sel] = self.sog_tile(int(step), int(tileLat), int(tileLon), speedKnots)[
+                    latIdx[sel] - tileLat * self.sogTile, lonIdx[sel] - tileLon * self.sogTile, sectors[sel]]
+        if not inside.all():
+            speeds[~inside] = self.sample_speeds(hours[~inside], lons[~inside], lats[~inside], bearingsDeg[~inside],
+                                                 speedKnots)
+        return speeds
+
+    def sample_speeds(self, hours, lons, lats, bearingsDeg, speedKnots):
+        """Speeds over ground [kn] of segments (see segment_speeds) from the weather and current data"""
+        speeds = np.full(len(hours), speedKnots, dtype=float)
         if self.inclWeather:
-            # Beaufort number (BN) and true wind direction (TWD) at (lon, lat)
-            BN, windDeg = self.weatherOp.get_grid_pt_wind(now, lon, lat)
-            headingDeg = bearingDeg
-            speedKnots = self.vessel.reduced_speed(windDeg, headingDeg, BN, speedKnots)
+            # Beaufort number (BN) and true wind direction (TWD) at segment middle points
+            BN, windDeg = self.weatherOp.sample(hours, lons, lats)
+            speeds = self.vessel.reduced_speed_array(windDeg, bearingsDeg, BN, speedKnots)
 
         if self.inclCurrent:
-            # Eastward (Se) and northward (Sn) current velocities at (lon, lat) in knots
-            Se, Sn = self.currentOp.get_grid_pt_current(now, lon, lat)
-
-            # Calculate speed over ground (actualSpeed)
-            actualSpeedKnots = calc_sog(radians(bearingDeg), Se, Sn, speedKnots)
-        else:
-            actualSpeedKnots = speedKnots
-
-        return nauticalMiles / actualSpeedKnots
+            # Eastward (Se) and northward (Sn) current velocities at segment middle points in knots
+            Se, Sn = self.currentOp.sample(hours, lons, lats)
+            speeds = calc_sog_array(np.radians(bearingsDeg), Se, Sn, speeds)
+        return speeds
+
+    def sog_tile(self, step, tileLat, tileLon, speedKnots):
+        """Speeds over ground [kn] (lat, lon, heading sector) for nominal *speedKnots* in time *step* at the grid
+        points of tile (*tileLat*, *tileLon*) of the data window of the finest weather/current operator.
+        Tiles have 'sogTile' by 'sogTile' grid points, and 'sogSectors' heading sectors centered at multiples of
+        360 / 'sogSectors' degrees. Hence, the field is only computed along the routes of the voyage"""
+        op = self.sogOp
+        lon0, lat0, resolution = op.grid
+        nWinLats, nWinLons = op.window[0].shape[1:]
+        lonIdx = np.arange(tileLon * self.sogTile, min((tileLon + 1) * self.sogTile, nWinLons))
+        latIdx = np.arange(tileLat * self.sogTile, min((tileLat + 1) * self.sogTile, nWinLats))
+        lons = lon0 + resolution * ((op.offsets[1] + lonIdx) % op.data[0].shape[2])
+        lats = lat0 + resolution * (op.offsets[0] + latIdx)
+        lons, lats = [np.repeat(a.ravel(), self.sogSectors) for a in np.meshgrid(lons, lats)]
+        headings = np.tile(np.arange(self.sogSectors) * 360. / self.sogSectors, len(latIdx) * len(lonIdx))
+        speeds = self.sample_speeds(np.full(len(lons), float(step * self.stepHours)), lons, lats, headings, speedKnots)
+        return speeds.astype(np.float32).reshape(len(latIdx), len(lonIdx), self.sogSectors)
 
 
 class Vessel:
@@ -264,6 +644,34 @@ class Vessel:
         self.speed_reduction = SemiEmpiricalSpeedReduction(blockCoefficient, shipLoading, Lpp, vol, DIR)
         self.reduced_speed = self.speed_reduction.reduced_speed
 
+        # Reduced speeds per Beaufort number, wind angle bin and vessel speed
+        self.speedTable = self.speed_reduction.speed_table(self.speeds)
+        self.speedIdx = {speed: i for i, speed in enumerate(self.speeds)}
+
+    def reduced_speed_array(self, windDeg, headingDeg, BN, nominalSpeedKnots):
+        """Vectorized reduced_speed for arrays of wind directions, headings and Beaufort numbers (BN).
+        Reduced speeds of integer BN and vessel speeds are gathered from the speed table.
+        *nominalSpeedKnots* is a speed or an array of speeds"""
+        if np.ndim(nominalSpeedKnots):
+            uniqueSpeeds, inverse = np.unique(nominalSpeedKnots, return_inverse=True)
+            uniqueIdx = [self.speedIdx.get(speed) for speed in uniqueSpeeds.tolist()]
+            speedIdx = None if None in uniqueIdx else np.array(uniqueIdx)[inverse.reshape(np.shape(nominalSpeedKnots))]
+        else:
+            speedIdx = self.speedIdx.get(nominalSpeedKnots)
+        if speedIdx is None:
+            return self.speed_reduction.reduced_speed_array(windDeg, headingDeg, BN, nominalSpeedKnots)
+        BN = np.asarray(BN, dtype=float)
+        BNIdx = np.clip(BN, 0, len(self.speedTable) - 1).astype(int)
+        speeds = self.speedTable[BNIdx, wind_angle_bin(windDeg, headingDeg), speedIdx]
+
+        # Compute speeds of fractional BN, e.g. of interpolated wind fields
+        other = BNIdx != BN
+        if other.any():
+            nominal = np.broadcast_to(nominalSpeedKnots, BN.shape)[other]
+            speeds[other] = self.speed_reduction.reduced_speed_array(np.asarray(windDeg)[other],
+                                                                     np.asarray(headingDeg)[other], BN[other], nominal)
+        return speeds
+
 
 class SemiEmpiricalSpeedReduction:
     """Based on Kwon's method for calculating the reduction of ship speed as a function of wind direction and speed.
@@ -332,21 +740,256 @@ class SemiEmpiricalSpeedReduction:
         actualSpeedKnots = nominalSpeedKnots * (1 - speedLossPercentage / 100)
         return actualSpeedKnots
 
+    def reduced_speed_array(self, windDeg, headingDeg, BN, nominalSpeedKnots):
+        """Vectorized reduced_speed for arrays of wind directions, headings, Beaufort numbers (BN) and/or speeds"""
+        BN = np.asarray(BN, dtype=float)
+        formC = self.aU * BN + np.power(BN, 6.5) * self.formDenominator
+        a, b, c = self.directionDF[wind_angle_bin(windDeg, headingDeg)].T
+        directionC = (a + b * np.power(BN + c, 2)) / 2
+        Fn = np.asarray(nominalSpeedKnots) * self.FnConstant
+        speedC = self.aB + self.bB * Fn + self.cB * np.power(Fn, 2)
+        speedLossPercentage = np.clip(directionC * speedC * formC, -30, 99)
+        return nominalSpeedKnots * (1 - speedLossPercentage / 100)
 
-def calc_sog(bearingRad, Se, Sn, V):
+    def speed_table(self, speeds, maxBN=12):
+        """Table (BN, wind angle bin, speed) of reduced speeds for Beaufort numbers 0 to *maxBN*,
+        the wind angle bins (see wind_angle_bin) and nominal *speeds*"""
+        angles = [0, 30, 60, 150]  # Lower bounds of wind angle bins
+        return np.array([[[self.reduced_speed(angle, 0, BN, speed) for speed in speeds] for angle in angles]
+                         for BN in range(maxBN + 1)])
+
+
+def wind_angle_bin(windDeg, headingDeg):
+    """Index of wind angle bin [0, 30), [30, 60), [60, 150) or [150, 180] degrees of wind relative to heading"""
+    windAngle = np.abs((np.asarray(windDeg) - headingDeg + 180) % 360 - 180)
+    return np.digitize(windAngle, [30, 60, 150])
+
+
+def calc_sog_array(bearingRad, Se, Sn, V):
     """
-    Determine speed over ground (sog) between points p1 and p2 in knots.
+    Determine speed over ground (sog) in knots of arrays of headings *bearingRad*, eastward (Se) and northward (Sn)
+    current velocities and speeds through water (V).
     see thesis section Ship Speed
     """
+    sinB, cosB = np.sin(bearingRad), np.cos(bearingRad)
+    radicand = V * V - (Se * cosB - Sn * sinB) ** 2
+    return np.where(radicand < 0, V, Se * sinB + Sn * cosB + np.sqrt(np.maximum(radicand, 0)))
+
+
+def geos_x_segments(treeDict, q1s, q2s):
+    """Bulk version of geo_x_geos for line segments (q1s[i], q2s[i]), e.g. all sub-segments of one or more legs.
+    If *treeDict* has a raster, segments are pre-screened on it and only undecided segments are tested exactly
+    in one query of the Shapely STRtree. Returns boolean array of segment intersections"""
+    if len(q1s) == 0:
+        return np.zeros(0, dtype=bool)
+    if 'raster' in treeDict:
+        screen = raster_x_segments(treeDict['raster'], q1s, q2s)
+        hits, undecided = screen == 1, screen < 0
+        if undecided.any():
+            hits[undecided] = strtree_x_segments(treeDict['strtree'], q1s[undecided], q2s[undecided])
+        return hits
+    return strtree_x_segments(treeDict['strtree'], q1s, q2s)
+
+
+def any_x_segments(treeDict, q1s, q2s, leafSegs=16):
+    """Returns True if any line segment (q1s[i], q2s[i]) of a leg intersects the geometries of *treeDict*.
+    The envelope of all segments is tested first, and is bisected level by level only where it intersects a
+    geometry. Segments of sub-envelopes of at most *leafSegs* segments are tested exactly with geos_x_segments"""
+    if len(q1s) == 0:
+        return False
+    lo, hi = np.minimum(q1s, q2s), np.maximum(q1s, q2s)
+    lo, hi = np.vstack([lo, lo[:1]]), np.vstack([hi, hi[:1]])  # Padded for reduceat at end index
+    starts, ends = np.array([0]), np.array([len(q1s)])
+    while len(starts):
+        # Envelopes of sub-legs, of which only those intersecting a geometry are kept
+        bounds = np.ravel([starts, ends], order='F')
+        (minx, miny), (maxx, maxy) = np.minimum.reduceat(lo, bounds)[::2].T, np.maximum.reduceat(hi, bounds)[::2].T
+        hitIdx = np.unique(treeDict['strtree'].query(shapely.box(minx, miny, maxx, maxy), predicate='intersects')[0])
+        starts, ends = starts[hitIdx], ends[hitIdx]
+
+        # Test segments of small sub-legs exactly, and bisect the others
+        leaf = ends - starts <= leafSegs
+        if leaf.any():
+            segIdx = np.concatenate([np.arange(start, end) for start, end in zip(starts[leaf], ends[leaf])])
+            if geos_x_segments(treeDict, q1s[segIdx], q2s[segIdx]).any():
+                return True
+        starts, ends = starts[~leaf], ends[~leaf]
+        mids = (starts + ends) // 2
+        starts, ends = np.ravel([starts, mids], order='F'), np.ravel([mids, ends], order='F')
+    return False
 
-    # Calculate speed over ground (sog)
-    sinB, cosB = sin(bearingRad), cos(bearingRad)
-    try:
-        result = Se * sinB + Sn * cosB + sqrt(V * V - (Se * cosB - Sn * sinB) ** 2)
-    except ValueError:
-        print('ValueError')
-        result = V
-    return result
+
+def strtree_x_segments(tree, q1s, q2s):
+    hits = np.zeros(len(q1s), dtype=bool)
+    lines = shapely.linestrings(np.stack([q1s, q2s], axis=1))
+    segIdx, _ = tree.query(lines, predicate='intersects')
+    hits[segIdx] = True
+    return hits
+
+
+def arc_x_geos(treeDict, p1, p2):
+    """Exact test whether the great circle arc between *p1* and *p2* intersects the geometries of *treeDict*.
+    The arc is intersected on the unit sphere with all edges of the geometries hit by its envelope at once"""
+    tree = treeDict['strtree']
+    a, b = unit_vectors(*np.array([p1, p2], dtype=float).T)
+    geoIdx = np.unique(tree.query(arc_envelopes(p1, p2, a, b), predicate='intersects')[1])
+    if len(geoIdx) == 0:
+        return False
+
+    # Arc with an endpoint inside a geometry need not cross any of its edges
+    if shapely.intersects(tree.geometries.take(geoIdx)[:, None], shapely.points([p1, p2])).any():
+        return True
+    c, d = geometry_edges(treeDict, geoIdx)
+    return bool(arcs_x_arc(a, b, c, d).any())
+
+
+def unit_vectors(lons, lats):
+    """Unit vectors (x, y, z) on the sphere of points in degrees"""
+    lons, lats = np.radians(lons), np.radians(lats)
+    return np.stack([np.cos(lats) * np.cos(lons), np.cos(lats) * np.sin(lons), np.sin(lats)], axis=-1)
+
+
+def arc_envelopes(p1, p2, a, b):
+    """Lon/lat boxes enclosing great circle arc between *p1* and *p2* with unit vectors *a* and *b*.
+    The arc is split in two boxes if it crosses the datum line"""
+    miny, maxy = (p1[1], p2[1]) if p1[1] < p2[1] else (p2[1], p1[1])
+    nx, ny, nz = np.cross(a, b).tolist()
+    nNorm = sqrt(nx * nx + ny * ny + nz * nz)
+    if nNorm > 0:
+        # Rate of change of z along arc at endpoints, which changes sign at the vertices of the great circle
+        za, zb = nx * a[1] - ny * a[0], nx * b[1] - ny * b[0]
+        vertexLat = np.degrees(np.arccos(min(abs(nz) / nNorm, 1.)))  # Max. latitude of great circle
+        if za > 0 > zb:
+            maxy = vertexLat
+        elif za < 0 < zb:
+            miny = -vertexLat
+    minx, maxx = (p1[0], p2[0]) if p1[0] < p2[0] else (p2[0], p1[0])
+    if maxx - minx > 180:
+        return shapely.box([maxx, -180], miny, [180, minx], maxy)
+    return shapely.box([minx], miny, [maxx], maxy)
+
+
+def check_arc_x_geos(nLegs=1500, nPolys=200, spacing=1., seed=0):
+    """Regression check of arc_x_geos against the great circle arcs sampled every *spacing* nautical miles, for
+    random legs and random boxes. Half of the legs are mid/high latitude east-west legs, of which the arcs bulge
+    poleward beyond their endpoints (see arc_envelopes). Returns the legs (p1, p2) for which the tests differ"""
+    rng = np.random.default_rng(seed)
+    centers = np.column_stack([rng.uniform(-170, 170, nPolys), rng.uniform(-80, 80, nPolys)])
+    halfSizes = rng.uniform(0.25, 2.5, (nPolys, 2))
+    tree = shapely.STRtree(shapely.box(*(centers - halfSizes).T, *(centers + halfSizes).T))
+    treeDict = {'strtree': tree}
+
+    # Random legs, and east-west legs between latitudes of 40 to 75 degrees, not crossing the datum line
+    nEW = nLegs // 2
+    lons1 = rng.uniform(-170, 170, nLegs)
+    lats1 = np.concatenate([rng.uniform(-75, 75, nLegs - nEW), rng.choice([-1, 1], nEW) * rng.uniform(40, 75, nEW)])
+    lons2 = np.clip(lons1 + np.concatenate([rng.uniform(-60, 60, nLegs - nEW), rng.uniform(10, 70, nEW)]), -179, 179)
+    lats2 = np.concatenate([rng.uniform(-75, 75, nLegs - nEW), lats1[nLegs - nEW:] + rng.uniform(-3, 3, nEW)])
+
+    mismatches = []
+    for p1, p2 in zip(zip(lons1.tolist(), lats1.tolist()), zip(lons2.tolist(), lats2.tolist())):
+        # Sample great circle arc by spherical linear interpolation of its unit vectors
+        a, b = unit_vectors(*np.array([p1, p2]).T)
+        theta = np.arccos(np.clip(a @ b, -1., 1.))
+        if theta == 0:
+            continue
+        t = np.linspace(0., 1., int(np.ceil(np.degrees(theta) * 60. / spacing)) + 1)[:, None]
+        ps = (np.sin((1 - t) * theta) * a + np.sin(t * theta) * b) / np.sin(theta)
+        line = shapely.linestrings(np.degrees(np.arctan2(ps[:, 1], ps[:, 0])),
+                                   np.degrees(np.arcsin(np.clip(ps[:, 2], -1., 1.))))
+        if arc_x_geos(treeDict, p1, p2) != (len(tree.query(line, predicate='intersects')) > 0):
+            mismatches.append((p1, p2))
+    return mismatches
+
+
+def geometry_edges(treeDict, geoIdx, maxDeg=1.):
+    """Start and end unit vectors of the edges of geometries *geoIdx* in *treeDict*. Edges are straight
+    lon/lat lines, which are approximated by great circle arcs of at most *maxDeg* degrees.
+    Computed once per geometry and cached in *treeDict*"""
+    edgesDict = treeDict.setdefault('edges', {})
+    newIdx = [idx for idx in geoIdx if idx not in edgesDict]
+    if newIdx:
+        geos = treeDict['strtree'].geometries.take(newIdx)
+        lines = np.where(shapely.get_dimensions(geos) == 2, shapely.boundary(geos), geos)
+        parts, partIdx = shapely.get_parts(shapely.segmentize(lines, maxDeg), return_index=True)
+        coords, coordIdx = shapely.get_coordinates(parts, return_index=True)
+        ps = unit_vectors(coords[:, 0], coords[:, 1])
+
+        # Edges between consecutive coordinates of the same part
+        sameEdge = coordIdx[:-1] == coordIdx[1:]
+        geoEdges = partIdx[coordIdx[:-1][sameEdge]]
+        c, d = ps[:-1][sameEdge], ps[1:][sameEdge]
+        for i, idx in enumerate(newIdx):
+            edgesDict[idx] = c[geoEdges == i], d[geoEdges == i]
+    c, d = zip(*[edgesDict[idx] for idx in geoIdx])
+    return np.concatenate(c), np.concatenate(d)
+
+
+def arcs_x_arc(a, b, c, d):
+    """Boolean array of intersections of great circle arc (a, b) with arcs (c[i], d[i]), all unit vectors.
+    The great circles intersect in t and -t, which must lie on both arcs"""
+    n1, n2 = np.cross(a, b), np.cross(c, d)
+    t = np.cross(n1, n2)
+    sa, sb = np.cross(a, t) @ n1, np.cross(t, b) @ n1
+    sc = np.einsum('ij,ij->i', np.cross(c, t), n2)
+    sd = np.einsum('ij,ij->i', np.cross(t, d), n2)
+    plus = (sa >= 0) & (sb >= 0) & (sc >= 0) & (sd >= 0)
+    minus = (sa <= 0) & (sb <= 0) & (sc <= 0) & (sd <= 0)
+    return (plus | minus) & t.any(axis=1)
+
+
+def clip_miles(treeDict, q1s, q2s, ref_sys):
+    """Nautical miles of segments (q1s, q2s) inside the geometries of *treeDict*. Segments outside the union
+    bounding box of the geometries are rejected at once, the others are clipped in bulk to the geometries they
+    intersect. Geometries are assumed not to overlap"""
+    miles = np.zeros(len(q1s))
+    minx, miny, maxx, maxy = treeDict['bounds']
+    lo, hi = np.minimum(q1s, q2s), np.maximum(q1s, q2s)
+    idx = np.flatnonzero((hi[:, 0] >= minx) & (lo[:, 0] <= maxx) & (hi[:, 1] >= miny) & (lo[:, 1] <= maxy))
+    if len(idx) == 0:
+        return miles
+
+    lines = shapely.linestrings(np.stack([q1s[idx], q2s[idx]], axis=1))
+    segIdx, geoIdx = treeDict['strtree'].query(lines, predicate='intersects')
+    if len(segIdx) == 0:
+        return miles
+
+    # Clip segments and measure geodesic length of the clipped line parts
+    pieces = shapely.intersection(lines[segIdx], treeDict['strtree'].geometries.take(geoIdx))
+    parts, pieceIdx = shapely.get_parts(pieces, return_index=True)
+    isLine = shapely.get_type_id(parts) == 1
+    parts, pieceIdx = parts[isLine], pieceIdx[isLine]
+    coords, partIdx = shapely.get_coordinates(parts, return_index=True)
+    samePart = partIdx[1:] == partIdx[:-1]
+    if not samePart.any():
+        return miles
+    (lons1, lats1), (lons2, lats2) = coords[:-1][samePart].T, coords[1:][samePart].T
+    _, _, dist = ref_sys.inv(lons1, lats1, lons2, lats2)
+    partMiles = np.bincount(partIdx[1:][samePart], weights=dist / 1852.0, minlength=len(parts))
+    np.add.at(miles, idx[segIdx[pieceIdx]], partMiles)
+    return miles
+
+
+def raster_x_segments(rasterDict, q1s, q2s):
+    """Pre-screen segments on land/water raster. Segments within all-water cells do not intersect,
+    segments with an endpoint in an all-land cell do intersect.
+    Returns int8 array: 1 if segment intersects, 0 if not, -1 if undecided (touches mixed cells)"""
+    raster, sat, cellSize = rasterDict['raster'], rasterDict['sat'], rasterDict['cellSize']
+    nLat, nLon = raster.shape
+
+    # Cell indices of segment endpoints
+    i1 = np.clip(((q1s[:, 1] + 90) // cellSize).astype(int), 0, nLat - 1)
+    j1 = np.clip(((q1s[:, 0] + 180) // cellSize).astype(int), 0, nLon - 1)
+    i2 = np.clip(((q2s[:, 1] + 90) // cellSize).astype(int), 0, nLat - 1)
+    j2 = np.clip(((q2s[:, 0] + 180) // cellSize).astype(int), 0, nLon - 1)
+
+    # Number of non-water cells in bounding box of each segment
+    iMin, iMax, jMin, jMax = np.minimum(i1, i2), np.maximum(i1, i2) + 1, np.minimum(j1, j2), np.maximum(j1, j2) + 1
+    nonWater = sat[iMax, jMax] - sat[iMin, jMax] - sat[iMax, jMin] + sat[iMin, jMin]
+
+    screen = np.where(nonWater == 0, 0, -1).astype(np.int8)
+    screen[(raster[i1, j1] == 1) | (raster[i2, j2] == 1)] = 1
+    return screen
 
 
 def geo_x_geos(treeDict, p1, p2=None):
@@ -375,6 +1018,8 @@ if __name__ == '__main__':
     from geodesic import Geodesic
     from data_config.navigable_area import NavigableAreaGenerator
 
+    assert not check_arc_x_geos(), 'Exact arc land crossing test differs from densely sampled arcs'
+
     os.chdir('...')
 
     def test_kwon():
@@ -455,7 +1100,6 @@ if __name__ == '__main__':
         return evaluator
 
     # evl = test_evaluator(datetime.datetime(2015, 6, 21))
-    # evl.calc_seg_hours((179, 0), (-179, 0), 9.9, 100)
 
     def test_calc_sog():
         _V = 100
@@ -463,7 +1107,7 @@ if __name__ == '__main__':
 
         Se = -10
         Sn = 0
-        output2 = [calc_sog(bearingRad, Se, Sn, _V) for bearingRad in bearingRads]
+        output2 = calc_sog_array(bearingRads, Se, Sn, _V)
 
         plt.scatter(np.degrees(bearingRads), output2)
 
@@ -2,32 +2,45 @@ import haversine
 import math
 import numpy as np
 import pyproj
+import support
 
-from functools import lru_cache, wraps
+from functools import wraps
+
+WGS84_A = 6378137.0  # Semi-major axis [m] of WGS84 ellipsoid
+WGS84_F = 1 / 298.257223563  # Flattening of WGS84 ellipsoid
 
 
 def np_cache(function):
     """
-    Cache decorator for numpy arrays
+    Convert numpy array arguments of (cached) function to hashable tuples
     """
-    @lru_cache(maxsize=int(1e+6))
-    def cached_wrapper(gc, p1, p2):
-        return function(gc, p1, p2)
-
     @wraps(function)
-    def wrapper(gc, p1, p2):
-        if p1 is not tuple and p2 is not tuple:
+    def wrapper(p1, p2, *args, **kwargs):
+        if not isinstance(p1, tuple) or not isinstance(p2, tuple):
             p1 = tuple(p1)
             p2 = tuple(p2)
-        return cached_wrapper(gc, p1, p2)
+        return function(p1, p2, *args, **kwargs)
 
     return wrapper
 
 
 class Geodesic:
-    def __init__(self, dist_calc='ellipsoidal'):
+    def __init__(self, dist_calc='ellipsoidal', caches=None, pointsBytes=None):
         self.ref_sys = pyproj.Geod(ellps='WGS84')
 
+        # Cache methods in (planner's) cache manager
+        self.caches = support.CacheManager() if caches is None else caches
+        self.ellipsoidal = self.caches.memoize('ellipsoidal', self.ellipsoidal)
+        self.euclidean = self.caches.memoize('euclidean', self.euclidean)
+        self.rhumb_line = self.caches.memoize('rhumb_line', self.rhumb_line)
+        self.great_circle = np_cache(self.caches.memoize('great_circle', self.great_circle))
+        self.points = self.caches.memoize('points', self.points, maxBytes=pointsBytes)
+
+        self.distance, self.distCalc = None, None
+        self.set_distance(dist_calc)
+        self.fastMany = False  # Array methods approximate ellipsoidal distances with Andoyer-Lambert
+
+    def set_distance(self, dist_calc):
         if dist_calc == 'ellipsoidal':
             self.distance = self.ellipsoidal
         elif dist_calc == 'rhumb_line':
@@ -38,11 +51,78 @@ class Geodesic:
             raise ValueError(
                 "No distance calculation method specified."
                 " Choose 'ellipsoidal', 'rhumb_line', or 'great_circle'.")
+        self.distCalc = dist_calc
 
     def total_distance(self, ind):
-        return sum([self.distance(wp1[0], wp2[0]) for wp1, wp2 in zip(ind[:-1], ind[1:])])
+        wps = [wp[0] for wp in ind]
+        return float(self.distance_many(wps[:-1], wps[1:]).sum())
+
+    def distance_many(self, p1s, p2s, bearing=False):
+        """
+            Array version of distance for sequences of longitude-latitude pairs
+            Returns array of distances in nautical miles (and array of bearings in degrees)
+            """
+        (lons1, lats1), (lons2, lats2) = lon_lat_arrays(p1s), lon_lat_arrays(p2s)
+        if self.distCalc == 'ellipsoidal':
+            if self.fastMany:
+                return andoyer_lambert(lons1, lats1, lons2, lats2, bearing=bearing)
+            bearingsDeg, _, dist = self.ref_sys.inv(lons1, lats1, lons2, lats2)
+            return (dist / 1852.0, bearingsDeg) if bearing else dist / 1852.0  # To nautical miles
+
+        if self.distCalc == 'great_circle':
+            dist = haversine.haversine_vector(np.column_stack([lats1, lons1]), np.column_stack([lats2, lons2]),
+                                              unit='nmi')
+        else:
+            [lams1, phis1, lams2, phis2] = np.radians([lons1, lats1, lons2, lats2])
+            dPsi = np.log(np.tan(np.pi / 4 + phis2 / 2) / np.tan(np.pi / 4 + phis1 / 2))
+            dPhi = phis2 - phis1
+            with np.errstate(divide='ignore', invalid='ignore'):
+                q = np.where(np.abs(dPsi) > 10e-12, dPhi / dPsi, np.cos(phis1))
+            dLam = shortest_lon_diff(lams2 - lams1)
+            dist = np.sqrt(dPhi * dPhi + q * q * dLam * dLam) * 3440.1
+        return (dist, self.bearings_many(p1s, p2s)) if bearing else dist
+
+    def bearings_many(self, p1s, p2s):
+        """
+            Array of bearings in degrees for sequences of longitude-latitude pairs:
+            forward azimuths for ellipsoidal distances (spherical if fastMany), else rhumb line bearings
+            """
+        (lons1, lats1), (lons2, lats2) = lon_lat_arrays(p1s), lon_lat_arrays(p2s)
+        if self.distCalc == 'ellipsoidal':
+            if self.fastMany:
+                return andoyer_lambert(lons1, lats1, lons2, lats2, bearing=True)[1]
+            bearingsDeg, _, _ = self.ref_sys.inv(lons1, lats1, lons2, lats2)
+            return bearingsDeg
+        return calc_bearings(lons1, lats1, lons2, lats2)
+
+    def points_many(self, p1s, p2s, delS, dists=None):
+        """
+        Array version of points for sequences of longitude-latitude pairs, with points sampled along
+        the geodesics with pyproj's vectorized fwd. *dists* are the distances in nautical miles
+        between the pairs, computed if not given.
+        Returns arrays of lons and lats of all point sets concatenated, and array of offsets,
+        such that the points of pair i are lons[offsets[i]:offsets[i+1]]
+        """
+        (lons1, lats1), (lons2, lats2) = lon_lat_arrays(p1s), lon_lat_arrays(p2s)
+        dists = self.distance_many(p1s, p2s) if dists is None else np.asarray(dists, dtype=float)
+        azis, _, metres = self.ref_sys.inv(lons1, lats1, lons2, lats2)
+        nPoints = (dists / delS + 0.5).astype(int)
+        offsets = np.concatenate([[0], np.cumsum(nPoints + 2)])
+
+        # Intermediate points are equally spaced along the geodesic
+        pairIdx = np.repeat(np.arange(len(nPoints)), nPoints)
+        k = np.arange(len(pairIdx)) - np.repeat(np.cumsum(nPoints) - nPoints, nPoints) + 1
+        ptLons, ptLats, _ = self.ref_sys.fwd(lons1[pairIdx], lats1[pairIdx], azis[pairIdx],
+                                             metres[pairIdx] * k / (nPoints[pairIdx] + 1))
+
+        lons, lats = np.empty(offsets[-1]), np.empty(offsets[-1])
+        lons[offsets[:-1]], lats[offsets[:-1]] = lons1, lats1
+        lons[offsets[1:] - 1], lats[offsets[1:] - 1] = lons2, lats2
+        inner = np.ones(offsets[-1], dtype=bool)
+        inner[offsets[:-1]] = inner[offsets[1:] - 1] = False
+        lons[inner], lats[inner] = ptLons, ptLats
+        return lons, lats, offsets
 
-    @lru_cache(maxsize=int(1e+6))
     def ellipsoidal(self, p1, p2, bearing=False):
         """
             Get ellipsoidal distance from the longitude-latitude
@@ -57,7 +137,6 @@ class Geodesic:
         else:
             return dist / 1852.0  # To nautical miles
 
-    @lru_cache(maxsize=int(1e+6))
     def euclidean(self, p1, p2):
         """
             Get ellipsoidal distance from the longitude-latitude
@@ -67,7 +146,6 @@ class Geodesic:
         p1, p2 = np.asarray(p1), np.asarray(p2)
         return np.linalg.norm(p2 - p1)
 
-    @lru_cache(maxsize=int(1e+6))
     def rhumb_line(self, p1, p2, bearing=False):
         """
             Get rhumb line distance from the longitude-latitude
@@ -92,7 +170,6 @@ class Geodesic:
         else:
             return math.sqrt(dPhi * dPhi + q * q * dLam * dLam) * 3440.1  # nautical miles
 
-    @np_cache
     def great_circle(self, p1, p2, bearing=False):
         """
             Get great circle distance from the longitude-latitude
@@ -105,7 +182,6 @@ class Geodesic:
         else:
             return haversine.haversine(reversed(p1), reversed(p2), unit='nmi')  # nautical miles
 
-    @lru_cache(maxsize=int(1e+6))
     def points(self, p1, p2, dist, delS):
         """
         Get great circle points from the longitude-latitude
@@ -116,19 +192,63 @@ class Geodesic:
         ==============   =======================================================
         del_s            points on great circle computed every del_s nautical miles
         ==============   =======================================================
-        Returns two lists of lons, lats points on great circle
+        Returns read-only array of lons (row 0) and lats (row 1) of points on great circle
         """
         (lon1, lat1), (lon2, lat2) = p1, p2
         nPoints = int(dist / delS + 0.5)
-        lonLats = self.ref_sys.npts(lon1, lat1, lon2, lat2, nPoints)
-        lons, lats = [lon1], [lat1]
-        for lon, lat in lonLats:
-            lons.append(lon)
-            lats.append(lat)
-        lons.append(lon2)
-        lats.append(lat2)
-
-        return lons, lats
+        lonLats = np.empty((2, nPoints + 2))
+        self.ref_sys.inv_intermediate(lon1, lat1, lon2, lat2, npts=nPoints + 2, initial_idx=0, terminus_idx=0,
+                                      out_lons=lonLats[0], out_lats=lonLats[1], return_back_azimuth=True)
+        lonLats[:, 0], lonLats[:, -1] = p1, p2
+        lonLats.flags.writeable = False
+
+        return lonLats
+
+
+def andoyer_lambert(lons1, lats1, lons2, lats2, bearing=False):
+    """
+    Andoyer-Lambert approximation of ellipsoidal distances between arrays of longitude-latitude pairs,
+    i.e. the spherical distances with a first order flattening correction. Its error is of the order of the
+    squared flattening: within 0.0015% of the WGS84 geodesic for distances up to 10,000 nautical miles
+    (at most 0.15 nautical miles)
+    Returns array of distances in nautical miles (and array of spherical forward azimuths in degrees)
+    """
+    [lams1, phis1, lams2, phis2] = np.radians([lons1, lats1, lons2, lats2])
+    F, G, L = (phis1 + phis2) / 2, (phis1 - phis2) / 2, (lams1 - lams2) / 2
+    sinG2, cosG2 = np.sin(G) ** 2, np.cos(G) ** 2
+    sinF2, cosF2 = np.sin(F) ** 2, np.cos(F) ** 2
+    sinL2, cosL2 = np.sin(L) ** 2, np.cos(L) ** 2
+    S, C = sinG2 * cosL2 + cosF2 * sinL2, cosG2 * cosL2 + sinF2 * sinL2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        omega = np.arctan(np.sqrt(S / C))
+        R = np.sqrt(S * C) / omega
+        H1, H2 = (3 * R - 1) / (2 * C), (3 * R + 1) / (2 * S)
+        dist = 2 * omega * WGS84_A * (1 + WGS84_F * (H1 * sinF2 * cosG2 - H2 * cosF2 * sinG2))
+    dist = np.where(S == 0, 0., np.where(C == 0, np.pi * WGS84_A, dist)) / 1852.0  # To nautical miles
+    if not bearing:
+        return dist
+    dLam = lams2 - lams1
+    bearingsDeg = np.degrees(np.arctan2(np.sin(dLam) * np.cos(phis2),
+                                        np.cos(phis1) * np.sin(phis2) - np.sin(phis1) * np.cos(phis2) * np.cos(dLam)))
+    return dist, bearingsDeg
+
+
+def lon_lat_arrays(ps):
+    """Arrays of longitudes and latitudes of sequence of longitude-latitude pairs"""
+    ps = np.asarray(ps, dtype=float).reshape(-1, 2)
+    return ps[:, 0], ps[:, 1]
+
+
+def shortest_lon_diff(dLam):
+    """Longitude differences in radians of shortest route: |dLam| < PI"""
+    return np.where(np.abs(dLam) > np.pi, dLam - np.copysign(2 * np.pi, dLam), dLam)
+
+
+def calc_bearings(lons1, lats1, lons2, lats2):
+    """Array version of calc_bearing"""
+    [lams1, phis1, lams2, phis2] = np.radians([lons1, lats1, lons2, lats2])
+    dPsi = np.log(np.tan(np.pi / 4 + phis2 / 2) / np.tan(np.pi / 4 + phis1 / 2))
+    return np.degrees(np.arctan2(shortest_lon_diff(lams2 - lams1), dPsi))
 
 
 def calc_bearing(p1, p2):
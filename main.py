@@ -17,6 +17,7 @@ from deap import base, creator, tools, algorithms
 from operations import Operators
 from pathlib import Path
 from shapely.geometry import Point
+from weather import MAX_DAYS, period_days, registry as operatorRegistry
 
 
 pp = pprint.PrettyPrinter()
@@ -81,6 +82,7 @@ class RoutePlanner:
                              'graphDens': 4,       # Recursion level graph
                              'graphVarDens': 6,    # Variable recursion level graph
                              'splits': 3,          # Threshold for split_polygon (val 3 yields best performance)
+                             'rasterCell': 0.25,   # Cell size [deg] of land/water rasters for feasibility pre-screen
 
                              # MOEA parameters
                              'n': 336,             # Population size
@@ -105,10 +107,22 @@ class RoutePlanner:
                              'scaleFactor': 0.1,   # Scale factor for Exponential distribution
                              'delFactor': 1.2,     # Factor of deletions
                              'gauss': False,       # Use Gaussian mutation for insert and move operators
+                             'quantization': None,  # Waypoint grid size [deg] of operators, e.g. 1e-4
 
                              # Evaluation parameters
                              'segLengthF': 15,     # Length of linear approx. of great circle track for feasibility
-                             'segLengthC': 8       # same for ocean currents and wind along route
+                             'exactArcs': False,   # Test land crossings exactly on great circle arcs
+                             'segLengthC': 8,      # same for ocean currents and wind along route
+                             'timeBuckets': False,  # Interpolate leg travel times between weather/current time steps
+                             'bucketTolerance': 0.01,  # Max. relative error of interpolated leg travel times
+                             'sogSectors': None,   # Heading sectors of precomputed speed over ground field, e.g. 36
+                             'regionMargin': 10,   # Margin [deg] of weather/current data around initial routes
+                             'horizonMargin': 0.5,  # Margin of weather/current period, fraction of max. travel time
+                             'weatherBytes': int(2e9),  # Memory budget [bytes] of reused weather/current operators
+                             'cacheBytes': int(1e9),  # Memory budget [bytes] of planner caches
+                             'pointsBytes': int(2e8),  # Memory budget [bytes] of great circle points cache
+                             'edgeStore': True,    # Store leg feasibility on disk for subsequent runs
+                             'fastDistance': False  # Optimize with Andoyer-Lambert distances, re-score exactly
                              }
         self.p = {**defaultParameters, **inputParameters} if inputParameters else defaultParameters
         self.tb = _tb if tb is None else tb
@@ -117,7 +131,9 @@ class RoutePlanner:
         self.vessel = evaluation.Vessel(fuelPrice, vesselName, shipLoading, DIR=DIR)  # Vessel class instance
         self.fuelPrice = fuelPrice
         self.ecaFactor = ecaFactor              # Multiplication factor ECA fuel
-        self.geod = geodesic.Geodesic()         # Geodesic class instance
+        self.caches = support.CacheManager(self.p['cacheBytes'])  # Memory bounded caches of planner
+        self.geod = geodesic.Geodesic(caches=self.caches, pointsBytes=self.p['pointsBytes'])  # Geodesic instance
+        operatorRegistry.maxBytes = self.p['weatherBytes']  # Process-wide memory budget of weather operators
 
         # Load and pre-process shoreline, ECA, and Bathymetry geometries
         navAreaGenerator = NavigableAreaGenerator(self.p, DIR=DIR)
@@ -134,7 +150,11 @@ class RoutePlanner:
                                               self.geod,
                                               criteria,
                                               self.p,
-                                              DIR=DIR)
+                                              DIR=DIR,
+                                              caches=self.caches,
+                                              edgeStore=navAreaGenerator.get_edge_store(self.p['segLengthF'],
+                                                                                        self.p['exactArcs'])
+                                              if self.p['edgeStore'] else None)
         self.speedIdx = constantSpeedIdx
         # Initialize "Initializer"
         self.initializer = initialization.Initializer(self.evaluator,
@@ -370,7 +390,7 @@ class RoutePlanner:
 
                 # Step 2: Fitness assignment
                 invInds = [ind for ind in offspring if not ind.fitness.valid]
-                fits = self.tb.map(self.evaluator.evaluate, invInds)
+                fits = self.evaluator.evaluate_batch(invInds)
                 for ind, fit in zip(invInds, fits):
                     ind.fitness.values = fit
 
@@ -425,7 +445,7 @@ class RoutePlanner:
                 # Step 2: Fitness assignment of both pop and archive
                 archive_ex_pop = [ind for ind in archive if ind not in pop]
                 invInds = [ind for ind in pop + archive_ex_pop if not ind.fitness.valid]
-                fits = self.tb.map(self.evaluator.evaluate, invInds)
+                fits = self.evaluator.evaluate_batch(invInds)
                 for ind, fit in zip(invInds, fits):
                     ind.fitness.values = fit
 
@@ -441,7 +461,7 @@ class RoutePlanner:
         pp.pprint({'startEnd': startEnd, 'recompute': recompute, 'startDate': startDate, 'current': current,
                    'weather': weather, 'algorithm': algorithm, 'avoidArctic': avoidArctic,
                    'avoidAntarctic': avoidAntarctic})
-        support.clear_caches()  # Clear caches
+        self.caches.reset()  # Clear caches
         start, end = startEnd
         if start == end:
             return 'equal_start_end'
@@ -523,15 +543,39 @@ class RoutePlanner:
 
                 # Step 2: Fitness assignment
                 print('Fitness assignment:', end='')
-                fits = self.tb.map(self.evaluator.evaluate, initialPop)
+                self.evaluator.set_fidelity(fast=self.p['fastDistance'])
+                fits = self.evaluator.evaluate_batch(initialPop)
                 for ind, fit in zip(initialPop, fits):
                     ind.fitness.values = fit
                 print('\rFitness assigned')
-                self.evaluator.set_classes(current, weather, startDate, self.get_days(initialPop))
+                days, region = self.get_days(initialPop), self.get_region(initialPop)
+                self.evaluator.set_classes(current, weather, startDate, days, region)
                 self.tb.register("individual", initialization.init_individual, self.tb, subRoute)
 
                 # Begin the generational process
                 front, log, totalEvals0 = MOEA.optimize(initialPop)
+
+                # Re-score final front with exact distances
+                self.evaluator.set_fidelity(fast=False)
+                fits = self.evaluator.evaluate_batch(list(front))
+                if current or weather:
+                    print('Leg travel time cache: {} hits, {} misses, hit rate {:.1%}\n'
+                          'Leg speed row cache: {} hits, {} misses, hit rate {:.1%}'.format(
+                            *self.evaluator.leg_cache_info()))
+                    print('Leg segments departing beyond weather/current period:', self.evaluator.nBeyondHorizon)
+
+                    # Extend period to the arrival of the front's routes, outside the evaluation, and re-score
+                    hours = self.evaluator.arrival_hours(front)
+                    if hours > self.evaluator.horizonHours:
+                        newDays = min(int(math.ceil(hours * (1 + self.p['horizonMargin']) / 24)), MAX_DAYS)
+                        if period_days(newDays) > period_days(days):
+                            print('Extend weather/current period to {} days'.format(period_days(newDays)))
+                            self.evaluator.set_classes(current, weather, startDate, newDays, region)
+                            fits = self.evaluator.evaluate_batch(list(front))
+                        else:
+                            print('Routes exceed maximum weather/current period of {} days'.format(MAX_DAYS))
+                for ind, fit in zip(front, fits):
+                    ind.fitness.values = fit
                 self.tb.unregister("individual")
                 totalEvals.append(totalEvals0)
                 hypervolume = performance_indicators.hypervolume(front)
@@ -541,6 +585,8 @@ class RoutePlanner:
                 result['fronts'][routeIdx][subIdx] = deepcopy(front)
 
         result['avgEvals'] = np.average(totalEvals)
+        if self.evaluator.edgeStore is not None:
+            self.evaluator.edgeStore.flush()
 
         return result
 
@@ -548,6 +594,7 @@ class RoutePlanner:
         self.p = {**self.p, **newParameters}
         seed = newParameters.get('seed', self.operators.seed)
         self.operators = Operators(self.evaluator.e_feasible, self.vessel, self.geod, self.p, seed)
+        operatorRegistry.maxBytes = self.p['weatherBytes']
 
         if 'seed' in newParameters or 'avoidAntarctic' in newParameters or 'avoidArctic' in newParameters:
             # Re-populate R-Tree structures
@@ -558,25 +605,43 @@ class RoutePlanner:
                                                           self.evaluator.ecaRtree, self.initializer.bathTree,
                                                           self.geod, self.p, creator.Individual, self.speedIdx, DIR,
                                                           seed)
+            self.update_edge_store(navAreaGenerator)
+        elif 'exactArcs' in newParameters:
+            self.update_edge_store(NavigableAreaGenerator(self.p, DIR=DIR))
+
+    def update_edge_store(self, navAreaGenerator):
+        """Test leg feasibility for the current navigable area and land crossing method, and reopen its edge store"""
+        self.evaluator.exactArcs = self.p['exactArcs']
+        self.caches.clear('e_feasible')
+        if self.evaluator.edgeStore is not None:
+            self.evaluator.edgeStore.close()
+            self.evaluator.edgeStore = navAreaGenerator.get_edge_store(self.p['segLengthF'], self.p['exactArcs'])
 
     def get_days(self, pop):
         """
-        Get estimate of max travel time of inds in *pop* in whole days
+        Get estimate of max travel time of inds in *pop* in whole days, including safety margin
         """
         boatSpeed = min(self.vessel.speeds)
-        maxTravelTime = 0
-        for ind in pop:
-            travelTime = 0.0
-            for i in range(len(ind) - 1):
-                p1, p2 = (ind[i][0], ind[i+1][0])
-                edgeDist = self.geod.distance(p1, p2)
-                edgeTravelTime = edgeDist / boatSpeed
-                travelTime += edgeTravelTime
-            if travelTime > maxTravelTime:
-                maxTravelTime = travelTime
-        days = min(int(math.ceil(maxTravelTime / 24)), 30)
+
+        # Travel times of all legs at once, summed per individual
+        indIdx = np.repeat(np.arange(len(pop)), [len(ind) - 1 for ind in pop])
+        p1s = [wp[0] for ind in pop for wp in ind[:-1]]
+        p2s = [wp[0] for ind in pop for wp in ind[1:]]
+        travelTimes = np.bincount(indIdx, weights=self.geod.distance_many(p1s, p2s) / boatSpeed, minlength=len(pop))
+        maxTravelTime = travelTimes.max(initial=0) * (1 + self.p['horizonMargin'])
+        # Data is loaded here, outside the evaluation. Routes sailing beyond the period hold its last time step
+        days = max(min(int(math.ceil(maxTravelTime / 24)), MAX_DAYS), 1)
         print('Number of days:', days)
-        return 30
+        return days
+
+    def get_region(self, pop):
+        """
+        Get lon/lat region of weather and current data around the waypoints of inds in *pop*
+        """
+        if self.p['regionMargin'] is None:
+            return None
+        lons, lats = np.array([wp[0] for ind in pop for wp in ind]).T
+        return support.lon_lat_region(lons, lats, self.p['regionMargin'])
 
     def create_route_response(self, obj, bestWeighted, wps, objValue, fitValue, xCanals, ID):
         if ID:
@@ -632,6 +697,7 @@ class RoutePlanner:
             self.evaluator.set_classes(current, weather, startDate, 10)
             self.evaluator.ecaFactor = updateEvaluator.get('eca', self.evaluator.ecaFactor)
 
+        self.evaluator.set_fidelity(fast=False)
         nFits = len([included for included in self.criteria.values() if included])
         objKeys = [obj for obj, included in self.criteria.items() if included]
         objIndices = {'minimalTime': 0, 'minimalCost': 1}
@@ -38,6 +38,8 @@ class Operators:
         self.gauss = par['gauss']               # Boolean for usage of Gaussian mutation
         self.nMoves = par['maxMoves']           # Maximum nr. performed moves
         self.moves = np.zeros(len(self.ops))    # Initialize moves count
+        self.quantization = par.get('quantization')  # Waypoint grid size [deg], None for no quantization
+        self.waypoints = {}                     # Interning table of generated waypoints
 
     def mutate(self, ind, initializing=False, k=None):
         # Ensure desired distribution of selected moves using weights based on the inverse number of moves.
@@ -61,7 +63,8 @@ class Operators:
         return ind,
 
     def insert_wps(self, ind, initializing=False, shape='rhombus'):
-        distances = [self.geod.distance(ind[i][0], ind[i+1][0]) for i, leg in enumerate(ind[:-1])]
+        wps = [wp[0] for wp in ind]
+        distances = self.geod.distance_many(wps[:-1], wps[1:])
 
         # Draw Exponential distributed number of edges weighted according to edge distance
         edges = self.sample_sequence(stop=len(ind)-1, weights=distances)
@@ -105,7 +108,7 @@ class Operators:
                 x -= np.int(x / 180) * 360
                 y = np.clip(y, -89.9, 89.9)
 
-                newWP = (x, y)
+                newWP = self.new_wp(x, y)
 
                 if initializing:
                     if not (self.e_feasible(ind[i][0], newWP) == 'inf' or self.e_feasible(newWP, ind[i+1][0]) == 'inf'):
@@ -122,8 +125,8 @@ class Operators:
 
     def move_wp(self, ind, initializing=False):
         # Find waypoints with largest angles
-        legs = list(zip([leg[0] for leg in ind[:-1]], [leg[0] for leg in ind[1:]]))
-        bearings = np.array([self.geod.distance(leg[0], leg[1], bearing=True)[1] for leg in legs])    # Get bearings
+        wps = [wp[0] for wp in ind]
+        bearings = self.geod.bearings_many(wps[:-1], wps[1:])    # Get bearings
         normDeg = (bearings[:-1] - bearings[1:]) % 360  # Normalize the difference
         absDiffsDeg = np.minimum(360 - normDeg, normDeg)  # in range [0, 180]
 
@@ -145,7 +148,7 @@ class Operators:
 
                 lon -= np.int(lon / 180) * 360
                 lat = np.clip(lat, -89.9, 89.9)
-                newWP = (lon, lat)
+                newWP = self.new_wp(lon, lat)
 
                 # Ensure feasibility during initialization
                 if initializing and (self.e_feasible(ind[i-1][0], newWP) == 'inf'
@@ -160,6 +163,17 @@ class Operators:
                 self.moves[-2] += 1
                 break
     
+    def new_wp(self, lon, lat):
+        """Waypoint (lon, lat), snapped to the quantization grid if set, and interned such that
+        identical waypoints share one tuple and cache keys repeat across individuals"""
+        if self.quantization:
+            lon = round(lon / self.quantization) * self.quantization
+            lat = round(lat / self.quantization) * self.quantization
+        wp = (float(lon), float(lat))
+        if len(self.waypoints) > 1e6:
+            self.waypoints.clear()
+        return self.waypoints.setdefault(wp, wp)
+
     def delete_wps(self, ind, initializing=False):
         # Draw gamma int for number of to be deleted (tbd) waypoints
         tbd = self.sample_sequence(start=1, stop=len(ind)-1)
@@ -229,8 +243,8 @@ class Operators:
                     c2 = c2s[i]
 
                     # If new edges not feasible, discard c2
-                    e1p1, e1p2 = tuple(ps2[c2-1]), tuple(ps1[c1])
-                    e2p1, e2p2 = tuple(ps1[c1-1]), tuple(ps2[c2])
+                    e1p1, e1p2 = ind2[c2-1][0], ind1[c1][0]
+                    e2p1, e2p2 = ind1[c1-1][0], ind2[c2][0]
                     if e1p1 == e1p2 or e2p1 == e2p2 or (self.e_feasible(e1p1, e1p2) == 'inf' or
                                                         self.e_feasible(e2p1, e2p2) == 'inf'):
                         continue
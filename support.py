@@ -1,6 +1,10 @@
 import functools
-import gc
+import os
 import numpy as np
+import sqlite3
+import sys
+
+from collections import OrderedDict
 
 from deap import tools
 from shapely.geometry import Polygon
@@ -210,11 +214,190 @@ locations = {'Agios Nikolaos': (25.726617, 35.152255),
              }
 
 
-def clear_caches():
-    gc.collect()
-    # noinspection PyProtectedMember
-    wrappers = [a for a in gc.get_objects() if isinstance(a, functools._lru_cache_wrapper)]
-
-    for wrapper in wrappers:
-        if wrapper.cache_info()[1] > 0:
-            wrapper.cache_clear()
+class CacheManager:
+    """Memoization caches sharing a memory budget of *maxBytes* bytes.
+    Each cache is a least recently used (LRU) dictionary of which the entry sizes are estimated in bytes.
+    If the caches exceed the budget, LRU entries of the largest cache are evicted first.
+    A cache may have its own budget as well"""
+
+    def __init__(self, maxBytes=int(1e9)):
+        self.maxBytes = maxBytes
+        self.caches = {}
+        self.nBytes = 0
+
+    def memoize(self, name, func, maxBytes=None):
+        """Wrap *func* with cache *name*, keyed on the positional and keyword arguments"""
+        cache = self.caches.setdefault(name, {'entries': OrderedDict(), 'nBytes': 0, 'maxBytes': maxBytes,
+                                              'hits': 0, 'misses': 0, 'evictions': 0})
+        entries = cache['entries']
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = args + tuple(kwargs.items()) if kwargs else args
+            try:
+                value = entries[key][0]
+            except KeyError:
+                cache['misses'] += 1
+                value = func(*args, **kwargs)
+                self.insert(cache, key, value)
+                return value
+            cache['hits'] += 1
+            entries.move_to_end(key)
+            return value
+
+        return wrapper
+
+    def insert(self, cache, key, value):
+        size = nbytes(key) + nbytes(value)
+        cache['entries'][key] = (value, size)
+        cache['nBytes'] += size
+        self.nBytes += size
+        if cache['maxBytes'] is not None and cache['nBytes'] > cache['maxBytes']:
+            self.evict(cache, cache['maxBytes'])
+        if self.nBytes > self.maxBytes:
+            # Evict from largest caches until 90% of the budget is used
+            target = 0.9 * self.maxBytes
+            while self.nBytes > target:
+                largest = max(self.caches.values(), key=lambda c: c['nBytes'])
+                self.evict(largest, largest['nBytes'] - (self.nBytes - target))
+
+    def evict(self, cache, maxBytes):
+        """Evict LRU entries from *cache* until it holds at most *maxBytes* bytes"""
+        entries = cache['entries']
+        while entries and cache['nBytes'] > maxBytes:
+            _, (_, size) = entries.popitem(last=False)
+            cache['nBytes'] -= size
+            cache['evictions'] += 1
+            self.nBytes -= size
+
+    def contains(self, name, key):
+        """True if cache *name* holds an entry for arguments *key*, without counting a lookup"""
+        return key in self.caches[name]['entries']
+
+    def info(self, name=None):
+        """Statistics of cache *name*, or of all caches if *name* is None"""
+        if name is None:
+            return {name: self.info(name) for name in self.caches}
+        cache = self.caches[name]
+        lookups = cache['hits'] + cache['misses']
+        return {'hits': cache['hits'], 'misses': cache['misses'], 'evictions': cache['evictions'],
+                'hitRate': cache['hits'] / lookups if lookups else 0., 'entries': len(cache['entries']),
+                'nBytes': cache['nBytes']}
+
+    def clear(self, name):
+        """Clear entries of cache *name*"""
+        cache = self.caches[name]
+        self.nBytes -= cache['nBytes']
+        cache['entries'].clear()
+        cache['nBytes'] = 0
+
+    def reset(self):
+        """Clear all caches and their statistics"""
+        for cache in self.caches.values():
+            cache['entries'].clear()
+            cache.update(nBytes=0, hits=0, misses=0, evictions=0)
+        self.nBytes = 0
+
+
+def nbytes(obj):
+    """Estimate of memory size of *obj* in bytes"""
+    if isinstance(obj, np.ndarray):
+        return sys.getsizeof(obj) + (0 if obj.base is None else obj.nbytes)
+    if isinstance(obj, (tuple, list)):
+        return sys.getsizeof(obj) + sum(nbytes(item) for item in obj)
+    return sys.getsizeof(obj)
+
+
+class EdgeStore:
+    """Persistent store of leg feasibility values in SQLite database *fp*, shared across runs.
+    Leg endpoints are quantized to *decimals* decimal degrees. Values are buffered and written
+    in batches of *bufferSize*, or on flush()"""
+
+    def __init__(self, fp, decimals=6, bufferSize=1000):
+        self.fp = fp
+        self.scale = 10 ** decimals
+        self.bufferSize = bufferSize
+        self.buffer = {}
+        self.con = sqlite3.connect(str(fp))
+        self.con.execute('CREATE TABLE IF NOT EXISTS edges (lon1 INTEGER, lat1 INTEGER, lon2 INTEGER, lat2 INTEGER, '
+                         'penalty INTEGER, value INTEGER, PRIMARY KEY (lon1, lat1, lon2, lat2, penalty)) '
+                         'WITHOUT ROWID')
+
+    def key(self, p1, p2, penalty):
+        return (round(p1[0] * self.scale), round(p1[1] * self.scale),
+                round(p2[0] * self.scale), round(p2[1] * self.scale), int(penalty))
+
+    def get(self, p1, p2, penalty):
+        """Stored value of leg (p1, p2), or None if not stored. Infeasible legs have value 'inf'"""
+        key = self.key(p1, p2, penalty)
+        value = self.buffer.get(key)
+        if value is None:
+            row = self.con.execute('SELECT value FROM edges WHERE lon1=? AND lat1=? AND lon2=? AND lat2=? '
+                                   'AND penalty=?', key).fetchone()
+            if row is None:
+                return None
+            value = row[0]
+        return 'inf' if value < 0 else value
+
+    def put(self, p1, p2, penalty, value):
+        self.buffer[self.key(p1, p2, penalty)] = -1 if value == 'inf' else value
+        if len(self.buffer) >= self.bufferSize:
+            self.flush()
+
+    def flush(self):
+        """Write buffered values to database"""
+        if self.buffer:
+            with self.con:
+                self.con.executemany('INSERT OR REPLACE INTO edges VALUES (?, ?, ?, ?, ?, ?)',
+                                     [key + (value,) for key, value in self.buffer.items()])
+            self.buffer.clear()
+
+    def close(self):
+        self.flush()
+        self.con.close()
+
+
+def mmap_arrays(fps, load):
+    """Read-only memory maps of arrays in .npy files *fps*. If a file does not exist, all files are written once
+    from the arrays returned by *load*, such that processes share the pages of one copy through the OS page cache"""
+    if not all(os.path.exists(fp) for fp in fps):
+        arrs = load()
+        for fp, arr in zip(fps, arrs):
+            print("Storing array to '{}':".format(fp), end=' ')
+            tmpFP = '{}.{}.tmp'.format(fp, os.getpid())
+            with open(tmpFP, 'wb') as f:
+                np.save(f, np.ascontiguousarray(arr))
+            os.replace(tmpFP, fp)  # Atomic, for concurrent processes
+            print('done')
+    return [np.load(fp, mmap_mode='r') for fp in fps]
+
+
+def quantize(arr, codec):
+    """Store float array *arr* as integers of codec (dtype, scale, fill): values are rounded to multiples
+    of scale and clipped to the dtype's range, NaN values are stored as fill. The precision is scale / 2"""
+    dtype, scale, fill = codec
+    info = np.iinfo(dtype)
+    lo, hi = info.min + (fill == info.min), info.max - (fill == info.max)  # Range excluding fill value
+    q = np.clip(np.round(np.asarray(arr, dtype=float) / scale), lo, hi)
+    return np.where(np.isnan(q), fill, q).astype(dtype)
+
+
+def dequantize(q, codec):
+    """Float array of integers *q* stored with quantize"""
+    dtype, scale, fill = codec
+    return np.where(q == fill, np.nan, q * scale)
+
+
+def lon_lat_region(lons, lats, margin):
+    """Smallest region (minLon, minLat, maxLon, maxLat) enclosing points (*lons*, *lats*) plus *margin* degrees.
+    If the region crosses the datum line, minLon > maxLon"""
+    lons = np.sort(np.asarray(lons, dtype=float))
+    minLat, maxLat = max(float(np.min(lats)) - margin, -90.), min(float(np.max(lats)) + margin, 90.)
+
+    # Region excludes the largest longitude gap between consecutive points
+    gaps = np.diff(lons, append=lons[0] + 360)
+    k = int(np.argmax(gaps))
+    if 360 - gaps[k] + 2 * margin >= 360:
+        return -180., minLat, 180., maxLat
+    minLon, maxLon = float(lons[(k + 1) % len(lons)]) - margin, float(lons[k]) + margin
+    return (minLon + 180) % 360 - 180, minLat, (maxLon + 180) % 360 - 180, maxLat
@@ -3,41 +3,64 @@ import math
 import matplotlib.pyplot as plt
 import numpy as np
 
-from dask.cache import Cache
+import support
+
+from collections import OrderedDict
 from mpl_toolkits import basemap
 
+MAX_DAYS = 90  # Maximum number of days of data periods
+PERIOD_DAYS = (15, 30, 60, MAX_DAYS)  # Data periods [days] loaded by the registry, such that voyages share data files
+
 
 class CurrentOperator:
-    def __init__(self, t0, nDays, DIR, KC):
+    def __init__(self, t0, nDays, DIR, KC, region=None):
         self.t0 = t0.replace(second=0, microsecond=0, minute=0, hour=0)
         self.nDays = nDays
+        self.DIR = DIR
+        self.region = region
         if KC:
             self.data, self.lons, self.lats = current_data.CurrentDataRetriever(self.t0,
                                                                                 self.nDays, DIR=DIR).get_kc_data()
             self.get_grid_pt_current = self.get_grid_pt_current_kc
+            self.sample = self.sample_kc
+            self.horizon = np.inf  # Kuroshio current data is time invariant
         else:
-            self.data = np.array(current_data.CurrentDataRetriever(self.t0, self.nDays, DIR=DIR).get_data())
+            self.load(nDays)
+
+        self.hourPeriod = 3  # Time step [h] of data
 
-        cache = Cache(2e9)  # Leverage two gigabytes of memory
-        cache.register()  # Turn cache on globally
+    def load(self, nDays):
+        self.nDays = nDays
+        self.horizon = nDays * 24  # Hours of data after t0; later samples hold the last time step
+        self.data = current_data.CurrentDataRetriever(self.t0, nDays, DIR=self.DIR).get_data()  # Memory maps
+        self.codecs = current_data.CODECS
+        self.grid = (-179.875, -89.875, 0.25)  # First grid point and resolution [deg]
+        self.window, self.offsets = crop_cube(self.data, self.region, *self.grid)
 
     def get_grid_pt_current(self, date_in, lon, lat):
-        hourPeriod = 3
         lonIdx = int(round((lon + 179.875) / 0.25))
         latIdx = int(round((lat + 89.875) / 0.25))
         delta = date_in - self.t0
-        if delta.days < self.nDays:
-            dayIdx = int(delta.seconds / 3600 // hourPeriod)
-            vals = self.data[:, dayIdx, latIdx, lonIdx]
-            u, v = vals[0], vals[1]
+        dayIdx = int(delta.total_seconds() / 3600 // self.hourPeriod)
+        dayIdx = min(max(dayIdx, 0), len(self.data[0]) - 1)  # hold first or last time step outside data
+        u, v = [float(support.dequantize(var[dayIdx, latIdx, lonIdx], codec))
+                for var, codec in zip(self.data, self.codecs)]
 
-            if math.isnan(u) or math.isnan(v):
-                u = v = 0.0
-        else:
+        if math.isnan(u) or math.isnan(v):
             u = v = 0.0
 
         return u, v
 
+    def sample(self, hours, lons, lats, method='nearest'):
+        """Eastward and northward current velocities [kn] at arrays of *hours* after t0 and (*lons*, *lats*).
+        Interpolation *method* is 'nearest', 'bilinear' or 'trilinear' (see sample_cube).
+        Velocities on land are zero, outside the data period those of its first or last time step are used"""
+        steps = np.asarray(hours, dtype=float) / self.hourPeriod
+        u, v = sample_window(self.data, self.window, self.offsets, steps, (np.asarray(lons) + 179.875) / 0.25,
+                             (np.asarray(lats) + 89.875) / 0.25, method, codecs=self.codecs)
+
+        return u, v
+
     def get_grid_pt_current_kc(self, _, lon, lat):
         lonIdx = find_nearest_idx(self.lons, lon)
         latIdx = find_nearest_idx(self.lats, lat)
@@ -45,12 +68,111 @@ class CurrentOperator:
 
         return u, v
 
+    def sample_kc(self, _, lons, lats, method='nearest'):
+        assert method == 'nearest', 'Kuroshio current data is sampled at nearest grid points'
+        lonIdx = np.abs(np.subtract.outer(lons, np.asarray(self.lons))).argmin(axis=1)
+        latIdx = np.abs(np.subtract.outer(lats, np.asarray(self.lats))).argmin(axis=1)
+
+        return self.data[0, latIdx, lonIdx], self.data[1, latIdx, lonIdx]
+
 
 def find_nearest_idx(array, value):
     array = np.asarray(array)
     return (np.abs(array - value)).argmin()
 
 
+def crop_cube(data, region, lon0, lat0, resolution):
+    """Window of global data cube *data*, a sequence of (time, lat, lon) arrays per variable, with first grid point
+    (*lon0*, *lat0*) and grid *resolution* in degrees, enclosing *region* (minLon, minLat, maxLon, maxLat).
+    If minLon > maxLon, the region crosses the datum line. Returns window arrays loaded in memory and their
+    (lat, lon) index offsets in *data*, or (None, (0, 0)) if *region* is None"""
+    if region is None:
+        return None, (0, 0)
+    minLon, minLat, maxLon, maxLat = region
+    nLats, nLons = data[0].shape[1:]
+    j0 = max(int(np.floor((minLat - lat0) / resolution)), 0)
+    j1 = min(int(np.ceil((maxLat - lat0) / resolution)), nLats - 1)
+    if maxLon - minLon >= 360:
+        return [np.array(var[:, j0:j1 + 1]) for var in data], (j0, 0)
+    i0 = int(np.floor((minLon - lon0) / resolution)) % nLons
+    nWinLons = min((int(np.ceil((maxLon - lon0) / resolution)) - i0) % nLons + 1, nLons)
+
+    # Columns beyond the last longitude continue at the first
+    window = [var[:, j0:j1 + 1, i0:i0 + nWinLons] for var in data]
+    if i0 + nWinLons > nLons:
+        window = [np.concatenate([win, var[:, j0:j1 + 1, :i0 + nWinLons - nLons]], axis=2)
+                  for win, var in zip(window, data)]
+    return [np.array(win) for win in window], (j0, i0)
+
+
+def sample_window(data, window, offsets, steps, lonIdx, latIdx, method='nearest', degVars=(), codecs=None):
+    """sample_cube on *window* of *data* with (lat, lon) index *offsets* (see crop_cube) at global fractional
+    indices. Points of which the enclosing grid points are not all in the window are sampled on *data*"""
+    if window is None:
+        return sample_cube(data, steps, lonIdx, latIdx, method, degVars, codecs)
+    nWinLats, nWinLons = window[0].shape[1:]
+    winLonIdx, winLatIdx = (lonIdx - offsets[1]) % data[0].shape[2], latIdx - offsets[0]
+    inside = (winLonIdx <= nWinLons - 1) & (winLatIdx >= 0) & (winLatIdx <= nWinLats - 1)
+    if inside.all():
+        return sample_cube(window, steps, winLonIdx, winLatIdx, method, degVars, codecs)
+    vals = np.empty((len(data), len(inside)))
+    vals[:, inside] = sample_cube(window, steps[inside], winLonIdx[inside], winLatIdx[inside], method, degVars,
+                                  codecs)
+    vals[:, ~inside] = sample_cube(data, steps[~inside], lonIdx[~inside], latIdx[~inside], method, degVars, codecs)
+    return vals
+
+
+def sample_cube(data, steps, lonIdx, latIdx, method='nearest', degVars=(), codecs=None):
+    """Values (var, n) of global data cube *data*, a sequence of (time, lat, lon) arrays per variable, at arrays of
+    fractional time step, latitude and longitude indices. Methods:
+        'nearest': nearest grid point in time step containing *steps*
+        'bilinear': interpolated between four enclosing grid points in time step containing *steps*
+        'trilinear': also interpolated between the enclosing time steps
+    Longitudes are cyclic, time steps outside the data hold the first or last time step. Grid points with a NaN value
+    (land) are zero. Variables *degVars* are directions in degrees, which are interpolated as unit vectors.
+    Quantized variables are decoded with *codecs* (see support.quantize)"""
+    nSteps, nLats, nLons = data[0].shape
+    if codecs is None:
+        def values(k, j, i):
+            return np.array([var[k, j, i] for var in data], dtype=float)
+    else:
+        def values(k, j, i):
+            return np.array([support.dequantize(var[k, j, i], codec) for var, codec in zip(data, codecs)])
+
+    stepIdx = np.clip(np.floor(steps), 0, nSteps - 1).astype(int)
+    if method == 'nearest':
+        latI, lonI = np.clip(np.round(latIdx), 0, nLats - 1).astype(int), np.round(lonIdx).astype(int) % nLons
+        vals = values(stepIdx, latI, lonI)
+        vals[:, np.isnan(vals).any(axis=0)] = 0.0
+        return vals
+
+    # Enclosing grid points and time steps, with weights of upper ones
+    lon0 = np.floor(lonIdx)
+    lat0 = np.clip(np.floor(latIdx), 0, nLats - 2)
+    i0, j0 = lon0.astype(int) % nLons, lat0.astype(int)
+    lonW, latW = lonIdx - lon0, np.clip(latIdx - lat0, 0., 1.)
+    if method == 'trilinear':
+        stepW = np.clip(steps - stepIdx, 0., 1.) * (stepIdx < nSteps - 1)
+        stepsW = [(stepIdx, 1 - stepW), (np.minimum(stepIdx + 1, nSteps - 1), stepW)]
+    else:
+        stepsW = [(stepIdx, 1.)]
+
+    # Sum weighted corner values, of directions as unit vectors
+    isDeg = np.isin(np.arange(len(data)), degVars)
+    vals = np.zeros((len(data), len(stepIdx)))
+    sinVals = np.zeros((isDeg.sum(), len(stepIdx)))
+    for k, tW in stepsW:
+        for j, yW in ((j0, 1 - latW), (j0 + 1, latW)):
+            for i, xW in ((i0, 1 - lonW), ((i0 + 1) % nLons, lonW)):
+                w = tW * yW * xW
+                corner = values(k, j, i)
+                vals[~isDeg] += w * np.nan_to_num(corner[~isDeg])
+                vals[isDeg] += w * np.nan_to_num(np.cos(np.radians(corner[isDeg])))
+                sinVals += w * np.nan_to_num(np.sin(np.radians(corner[isDeg])))
+    vals[isDeg] = np.degrees(np.arctan2(sinVals, vals[isDeg])) % 360
+    return vals
+
+
 def plot_current_field(uin, vin, lons, lats):
     plt.subplot()
     # Create map
@@ -75,30 +197,123 @@ def plot_current_field(uin, vin, lons, lats):
 
 
 class WindOperator:
-    def __init__(self, t0, nDays, DIR):
+    def __init__(self, t0, nDays, DIR, region=None):
         self.t0 = t0.replace(second=0, microsecond=0, minute=0, hour=0)
+        self.DIR = DIR
+        self.region = region
         # assert nDays * 8 < 384, 'Estimated travel days exceeds wind forecast period'
-        self.data = wind_data.WindDataRetriever(startDate=self.t0, nDays=nDays, DIR=DIR).get_data(forecast=False)
+        self.load(nDays)
+        self.hourPeriod = 6  # Time step [h] of data
 
-        cache = Cache(2e9)  # Leverage two gigabytes of memory
-        cache.register()  # Turn cache on globally
+    def load(self, nDays):
+        self.nDays = nDays
+        self.horizon = nDays * 24  # Hours of data after t0; later samples hold the last time step
+        self.data = wind_data.WindDataRetriever(startDate=self.t0, nDays=nDays, DIR=self.DIR).get_data(forecast=False)
+        self.codecs = wind_data.CODECS
+        self.grid = (-180., -90., 0.5)  # First grid point and resolution [deg]
+        self.window, self.offsets = crop_cube(self.data, self.region, *self.grid)
 
     def get_grid_pt_wind(self, time, lon, lat):
         resolution = 0.5
-        hourPeriod = 6
         lon_idx = int(round((lon + 180) / resolution))
         lon_idx = 0 if lon_idx == 720 else lon_idx  # data has no cyclic column; hence, refer long 180 to -180
         lat_idx = int(round((lat + 90) / resolution))
-        step_idx = int((time - self.t0).seconds / 3600 // hourPeriod)
-        vals = self.data[:, step_idx, lat_idx, lon_idx]
-        BN = vals[0]
-        TWD = vals[1]
+        step_idx = int((time - self.t0).total_seconds() / 3600 // self.hourPeriod)
+        step_idx = min(max(step_idx, 0), len(self.data[0]) - 1)  # hold first or last time step outside data
+        BN, TWD = [float(support.dequantize(var[step_idx, lat_idx, lon_idx], codec))
+                   for var, codec in zip(self.data, self.codecs)]
 
         if math.isnan(BN) or math.isnan(TWD):
             BN, TWD = 0, 0.0
 
         return BN, TWD
 
+    def sample(self, hours, lons, lats, method='nearest'):
+        """Beaufort number (BN) and true wind direction (TWD) at arrays of *hours* after t0 and (*lons*, *lats*).
+        Interpolation *method* is 'nearest', 'bilinear' or 'trilinear' (see sample_cube)"""
+        resolution = 0.5
+        steps = np.asarray(hours, dtype=float) / self.hourPeriod
+        BN, TWD = sample_window(self.data, self.window, self.offsets, steps, (np.asarray(lons) + 180) / resolution,
+                                (np.asarray(lats) + 90) / resolution, method, degVars=(1,), codecs=self.codecs)
+
+        return BN, TWD
+
+
+class OperatorRegistry:
+    """Process-wide registry of weather and current operators, reused for voyages of which they contain the data.
+    Operators are reference counted; unused operators are evicted least recently used first when the
+    operators' memory exceeds *maxBytes*. Memory-mapped data cubes are shared and not counted"""
+
+    def __init__(self, maxBytes=int(2e9)):
+        self.maxBytes = maxBytes
+        self.entries = OrderedDict()  # Operator: dict of key, region and reference count
+        self.hits = self.misses = 0
+
+    def acquire(self, cls, t0, nDays, DIR, region=None, **kwargs):
+        """Operator of class *cls* for *nDays* days from *t0* in *region* (see crop_cube), created if no registered
+        operator contains it. Operators are created for the shortest period of PERIOD_DAYS containing *nDays*,
+        of which the data files are shared by voyages from the same day. Release operator when no longer used"""
+        nDays = period_days(nDays)
+        key = (cls, t0.replace(second=0, microsecond=0, minute=0, hour=0), DIR, tuple(sorted(kwargs.items())))
+        for op, entry in reversed(self.entries.items()):  # Most recently used first
+            if entry['key'] == key and op.nDays >= nDays and region_contains(entry['region'], region):
+                self.hits += 1
+                entry['refs'] += 1
+                self.entries.move_to_end(op)
+                return op
+
+        self.misses += 1
+        op = cls(t0, nDays, DIR=DIR, region=region, **kwargs)
+        self.entries[op] = {'key': key, 'region': region, 'refs': 1}
+        self.evict()
+        return op
+
+    def release(self, op):
+        entry = self.entries.get(op)
+        if entry is not None:
+            entry['refs'] -= 1
+            self.evict()
+
+    def evict(self):
+        opsBytes = {op: operator_bytes(op) for op in self.entries}
+        nBytes = sum(opsBytes.values())
+        for op, entry in list(self.entries.items()):
+            if nBytes <= self.maxBytes:
+                break
+            if entry['refs'] <= 0:
+                nBytes -= opsBytes[op]
+                del self.entries[op]
+
+    def clear(self):
+        self.entries.clear()
+
+
+def period_days(nDays):
+    """Shortest data period of PERIOD_DAYS of at least *nDays* days, or MAX_DAYS"""
+    return next((days for days in PERIOD_DAYS if days >= nDays), MAX_DAYS)
+
+
+def operator_bytes(op):
+    """Memory size of operator's data in memory, i.e. excluding memory-mapped data"""
+    arrs = [op.data] if isinstance(op.data, np.ndarray) else list(op.data)  # Kuroshio current data is an array
+    arrs += getattr(op, 'window', None) or []
+    return sum(arr.nbytes for arr in arrs if not isinstance(arr, np.memmap))
+
+
+def region_contains(outer, inner):
+    """True if lon/lat region *outer* contains region *inner* (see crop_cube). Region None is the whole globe"""
+    if outer is None:
+        return True
+    if inner is None or inner[1] < outer[1] or inner[3] > outer[3]:
+        return False
+    if outer[2] - outer[0] >= 360:
+        return True
+    innerWidth = 360 if inner[2] - inner[0] >= 360 else (inner[2] - inner[0]) % 360
+    return (inner[0] - outer[0]) % 360 + innerWidth <= (outer[2] - outer[0]) % 360
+
+
+registry = OperatorRegistry()
+
 
 if __name__ == '__main__':
     from datetime import datetime